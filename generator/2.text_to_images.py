@@ -3,6 +3,8 @@
 from __future__ import print_function
 from itertools import product
 import multiprocessing
+import numpy as np
+from PIL import Image
 import cairo
 import pango
 import pangocairo
@@ -11,18 +13,28 @@ import os
 from TeluguFontProperties import FP_DICT
 
 #################################### Arguments
-if len(sys.argv) < 2:
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+if len(args) < 1:
     print("""
 Writes a given piece of text to an image files.
 One image per font style.
 The images will be located in <text_file>.images/*.tif
 Usage:
-{0} <text_file>
+{0} <text_file> [--png] [--lines=N]
  or
-{0}  <(echo 'text')""".format(sys.argv[0]))
+{0}  <(echo 'text')
+--png also saves the rendered page in <text_file>.images/pngs/
+--lines=N renders N lines of text per page, to <font>_<style>_L<first>.tif,
+    where <first> is the (zero based) number in the text of the page's first
+    line""".format(sys.argv[0]))
     sys.exit()
 
-text_file = sys.argv[1]
+text_file = args[0]
+write_png = '--png' in sys.argv
+page_lines = 0
+for arg in sys.argv:
+    if arg.startswith('--lines='):
+        page_lines = int(arg[len('--lines='):])
 if text_file.endswith('.txt'):
     imagedir = text_file[:-4]
 else:
@@ -41,33 +53,86 @@ with open(text_file) as fin:
 lines = text.split('\n')
 n_lines = len(lines)
 n_letters = max(len(line) for line in lines)
-size_x = 30 * n_letters + 50
-size_y = 150 * n_lines + 25
 print ("Lines: ", n_lines)
 print ("Letters: ", n_letters)
-print ("Size X: ", size_x)
-print ("Size Y: ", size_y)
+
+# Pages as (number of the first line, text); the whole text is one page
+# without --lines
+if page_lines:
+    pages = [(first, '\n'.join(lines[first:first + page_lines]))
+             for first in range(0, n_lines, page_lines)]
+    pages = [(first, page) for first, page in pages if page.strip()]
+else:
+    pages = [(None, text)]
+print ("Pages: ", len(pages))
 
 #################################### Pango Cairo
+MARGIN_X, MARGIN_Y = 50, 25
 
-surf = cairo.ImageSurface(cairo.FORMAT_RGB24, size_x, size_y)
-context = cairo.Context(surf)
-pangocairo_context = pangocairo.CairoContext(context)
-pangocairo_context.set_antialias(cairo.ANTIALIAS_SUBPIXEL)
 
-layout = pangocairo_context.create_layout()
-layout.set_text(text)
+def make_layout(surface, fontstyle, spc, page_text):
+    context = cairo.Context(surface)
+    pangocairo_context = pangocairo.CairoContext(context)
+    pangocairo_context.set_antialias(cairo.ANTIALIAS_SUBPIXEL)
+
+    layout = pangocairo_context.create_layout()
+    layout.set_font_description(pango.FontDescription(fontstyle))
+    layout.set_spacing(spc * 20480)
+    layout.set_text(page_text)
+    return context, pangocairo_context, layout
+
+
+def page_extents(fontstyle, spc, page_text):
+    """
+    Measure the laid out text on a scratch surface.
+    :return: left, top, width, height of the ink and logical extents together
+    """
+    scratch = cairo.ImageSurface(cairo.FORMAT_RGB24, 1, 1)
+    _, _, layout = make_layout(scratch, fontstyle, spc, page_text)
+    rects = layout.get_pixel_extents()
+    left = min(x for x, _, _, _ in rects)
+    top = min(y for _, y, _, _ in rects)
+    right = max(x + wd for x, _, wd, _ in rects)
+    bottom = max(y + ht for _, y, _, ht in rects)
+    return left, top, right - left, bottom - top
 
 style_ids = {'': 'NR', ' Bold': 'BL', ' Italic': 'IT', ' Bold Italic': 'BI'}
 image_file_namer = "{}{{}}_{{}}.png".format(imagedir).replace(" ", "_").format
 png_dir = imagedir+'pngs/'
-os.system('mkdir ' + png_dir)
+if write_png:
+    os.system('mkdir ' + png_dir)
+
+#################################### Binarization
+THRESHOLD = 128  # Grey level below which a pixel is ink
+
+
+def write_tiff(surface, tif_file_name):
+    """
+    Threshold the RGB24 surface to black and white and save it as a 1-bit
+    TIFF. The pixels are read in place from the surface's buffer.
+    """
+    surface.flush()
+    ht, wd = surface.get_height(), surface.get_width()
+    pixels = np.frombuffer(surface.get_data(), np.uint8)
+    pixels = pixels.reshape(ht, surface.get_stride())[:, :4 * wd]
+    pixels = pixels.reshape(ht, wd, 4)
+    # Each pixel is a native endian 32 bit xRGB word
+    rgb = pixels[:, :, :3] if sys.byteorder == 'little' else pixels[:, :, 1:]
+
+    white = rgb.sum(axis=2, dtype=np.uint16) >= 3 * THRESHOLD
+    bits = np.packbits(white, axis=1)  # Rows padded to bytes, as PIL wants
+    Image.frombytes('1', (wd, ht), bits.tobytes()).save(
+        tif_file_name, compression='group4')
 
 #################################### Main Rendering Function
-def render((fontname, style)):
+def render((fontname, style, page)):
     [sz, gho, rep, ppu, spc, abbr, hasbold] = FP_DICT[fontname]
+    first_line, page_text = page
 
     png_file_name = image_file_namer(abbr,  style_ids[style])
+    if first_line is not None:
+        png_file_name = png_file_name.replace(
+            ".png", "_L{:05d}.png".format(first_line))
     tif_file_name = png_file_name.replace("png", "tif")
 
     if os.path.isfile(tif_file_name):
@@ -80,26 +145,26 @@ def render((fontname, style)):
 
     fontstyle = fontname + ',' + style + ' ' + str(sz)
 
-    font = pango.FontDescription(fontstyle)
-    layout.set_font_description(font)
-    layout.set_spacing(spc * 20480)
-    context.rectangle(0, 0, size_x, size_y)
+    # The surface is sized to fit the text, plus margins
+    left, top, wd, ht = page_extents(fontstyle, spc, page_text)
+    surf = cairo.ImageSurface(cairo.FORMAT_RGB24,
+                              wd + 2 * MARGIN_X, ht + 2 * MARGIN_Y)
+    context, pangocairo_context, layout = make_layout(surf, fontstyle, spc,
+                                                      page_text)
     context.set_source_rgb(1, 1, 1)
-    context.fill()
-    context.translate(50, 25)
+    context.paint()
+    context.translate(MARGIN_X - left, MARGIN_Y - top)
     context.set_source_rgb(0, 0, 0)
     pangocairo_context.update_layout(layout)
     pangocairo_context.show_layout(layout)
 
-    print("Rendering ", abbr + style)
-    with open(png_file_name, "wb") as image_file:
-        surf.write_to_png(image_file)
-    context.translate(-50, -25)
+    print("Rendering ", os.path.basename(tif_file_name))
+    write_tiff(surf, tif_file_name)
 
-    os.system('bin/zealous ' + png_file_name)
-    print ("Moving " + png_file_name)
-    os.system('mv {} {}'.format(png_file_name, png_dir))
+    if write_png:
+        with open(png_dir + os.path.basename(png_file_name), "wb") as image_file:
+            surf.write_to_png(image_file)
 
 ######################################### Main Loop
 pool = multiprocessing.Pool(4)
-pool.map(render, product(sorted(FP_DICT), style_ids))
+pool.map(render, product(sorted(FP_DICT), style_ids, pages))
@@ -1,36 +1,103 @@
 #! /usr/bin/env python3
+import asyncio
 import os
+import shlex
 import sys
+import time
 
 ########################## Process Arguments
 try:
     img_dir = sys.argv[1]
 except IndexError:
-    print('Usage: ' + sys.argv[0] + ' <Directory>/ [banti_exe]\n'
-          'Directory is location of the images to be fed to banti')
+    print('Usage: ' + sys.argv[0] + ' <Directory>/ [banti_exe] [jobs]\n'
+          'Directory is location of the images to be fed to banti\n'
+          'jobs is the number of segmenters run at a time, '
+          'by default one per core')
     sys.exit()
 
 try:
-    banti_exe = sys.argv[2] + ' '
+    banti_exe = shlex.split(sys.argv[2])
 except IndexError:
-    banti_exe = 'bin/segmenter'
+    banti_exe = ['bin/segmenter']
+
+try:
+    njobs = int(sys.argv[3])
+except IndexError:
+    njobs = os.cpu_count() or 1
 
 if img_dir[-1] != '/':
     img_dir += '/'
-flags = '2 9 >'
+flags = ['2', '9']
 
-########################### Process all the tif files with banti segmenter
-file_list = sorted(os.listdir(img_dir))
 
-for img_name in file_list:
+########################### Jobs
+async def segment(img_name, slots):
+    """
+    Run the segmenter on one image. Its output goes to a temporary file that
+    is renamed to .out only if the segmenter succeeds, so an .out file is
+    always a finished one.
+    :return: (img_name, exit status, seconds taken), the status is None if
+        the segmenter could not be started
+    """
+    full_name = img_dir + img_name
+    out_name = full_name[:-3] + 'out'
+    tmp_name = out_name + '.part'
+
+    async with slots:
+        print("Feeding ", img_name)
+        start = time.time()
+        try:
+            with open(tmp_name, 'wb') as out_fp:
+                proc = await asyncio.create_subprocess_exec(
+                    *banti_exe, full_name, *flags, stdout=out_fp)
+                status = await proc.wait()
+        except OSError as e:  # Segmenter missing, not executable, ...
+            print("Could not run segmenter on", img_name, ":", e)
+            status = None
+        took = time.time() - start
+
+    if status == 0:
+        os.replace(tmp_name, out_name)
+    else:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        if status is not None:
+            print("Failed ", img_name, "with exit status", status)
+    return img_name, status, took
+
+
+async def segment_all(img_names):
+    slots = asyncio.Semaphore(njobs)
+    return await asyncio.gather(*(segment(img_name, slots)
+                                  for img_name in img_names))
+
+
+########################### Process all the tif files with banti segmenter
+todo = []
+for img_name in sorted(os.listdir(img_dir)):
     if img_name[-4:] != '.tif':
         continue
 
-    full_name = img_dir + img_name
-    if os.path.isfile(full_name[:-3] + 'out'):
+    if os.path.isfile(img_dir + img_name[:-3] + 'out'):
         print("Skipping processed file:", img_name)
         continue
 
-    print("Feeding ", img_name)
-    command = "{} {} {} {}".format(banti_exe, full_name, flags, full_name.replace('.tif', '.out'))
-    os.system(command)
\ No newline at end of file
+    todo.append(img_name)
+
+start = time.time()
+results = asyncio.run(segment_all(todo))
+total = time.time() - start
+
+########################### Summary
+print("\n{:40} {:>6} {:>8}".format("File", "Status", "Seconds"))
+for img_name, status, took in sorted(results, key=lambda r: -r[2]):
+    print("{:40} {:>6} {:>8.2f}".format(img_name, str(status), took))
+
+failed = [img_name for img_name, status, _ in results if status != 0]
+print("\nSegmented {} of {} files with {} jobs in {:.2f}s "
+      "({:.2f}s of segmenter time)".format(
+    len(results) - len(failed), len(results), njobs, total,
+    sum(took for _, _, took in results)))
+if failed:
+    print("Failed:", " ".join(failed))
+    sys.exit(1)
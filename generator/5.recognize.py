@@ -1,9 +1,10 @@
 import random
 import sys
 import os
-import logging
+import multiprocessing
 
 import banti.ocr as ocr
+from banti import trace
 
 ########################################## Arguments
 from parser import Parser
@@ -11,10 +12,13 @@ from parser import Parser
 try:
     prefix = sys.argv[1]
 except IndexError:
-    print('Usage: ' + sys.argv[0] + ''' <prefix for the images and text file> [loglevel=info]
+    print('Usage: ' + sys.argv[0] + ''' <prefix for the images and text file> [loglevel=info] [workers]
         <prefix>.images are read one by one and box files are scanned using the text file
         <prefix>.txt
-        loglevel is one of c(ritical), e(rror), w(arning), i(nfo), d(ebug)''')
+        loglevel is one of c(ritical), e(rror), w(arning), i(nfo), d(ebug),
+        optionally followed by levels of subsystems, like
+        info,ngramgraph=warning,bantry=warning
+        workers is the number of processes, by default one per available core''')
     sys.exit()
 
 if prefix[-1] != '.':
@@ -24,31 +28,71 @@ img_dir = prefix + 'images/'
 txt_file = prefix + 'txt'
 
 try:
-    log_level = sys.argv[2]
+    log_level, _, log_levels = sys.argv[2].partition(',')
 except IndexError:
-    log_level = "info"
-log_level = {
-    'c': logging.CRITICAL,
-    'e': logging.ERROR,
-    'w': logging.WARNING,
-    'i': logging.INFO,
-    'd': logging.DEBUG}.get(log_level.lower()[0], logging.INFO)
-
-######################################### Init OCR
-
-oseer = ocr.OCR('banti/library/nn.pkl',
-        'banti/library/rel48.scl',
-        'banti/library/alphacodes.lbl',
-        'banti/library/mega.123.pkl',
-        loglevel=log_level)
+    log_level, log_levels = "info", ""
+log_level = trace.parse_level(log_level)
+
+try:
+    nworkers = int(sys.argv[3])
+except IndexError:
+    nworkers = len(os.sched_getaffinity(0)) \
+        if hasattr(os, 'sched_getaffinity') else multiprocessing.cpu_count()
+
+# Histories kept per node by the n-gram search, None searches them all.
+# 32 agreed with the full search on all the synthetic lines of
+#     python3 -m banti.benchmarks beam 20 30 32
+beam_width = 32
+
+# Prefer the memory-mapped model made by banti.ngramfile, shared by workers
+ngram_fname = 'banti/library/mega.123.ngb'
+if not os.path.isfile(ngram_fname):
+    ngram_fname = 'banti/library/mega.123.pkl'
+
+######################################### Per worker OCR & Parser
+parser = None
+
+
+def init_worker(log_queue):
+    """
+    Send the worker's log records to the parent, and load the models and
+    the text once per worker, instead of once per file.
+    """
+    global parser
+    trace.log_to_queue(log_queue, log_level)
+    trace.log_to_queue(log_queue, log_level, 'parser')
+    trace.set_levels(log_levels)
+    oseer = ocr.OCR('banti/library/nn.pkl',
+            'banti/library/rel48.scl',
+            'banti/library/alphacodes.lbl',
+            ngram_fname,
+            loglevel=log_level,
+            cache_fname=prefix + 'classified.sqlite',
+            beam_width=beam_width)
+    parser = Parser(oseer, txt_file, prefix)
+
+
+def get_file_list():
+    """
+    :return: box files, largest first, so that the long ones are started
+        early instead of being left for the end of the run
+    """
+    file_list = [f for f in os.listdir(img_dir) if f.endswith('.box')]
+    # Prefer binary box files made by banti.boxfile when they exist
+    file_list = [f + 'b' if os.path.isfile(img_dir + f + 'b') else f
+                 for f in file_list]
+    return sorted(file_list, key=lambda f: os.path.getsize(img_dir + f),
+                  reverse=True)
 
 ######################################### Final Loop
+# Workers' log records are written out here, to the log of their box file
+log_queue = multiprocessing.Queue()
+log_listener = trace.start_listener(log_queue, log_level)
+
 if 1:
-    import multiprocessing
     import traceback
 
     def process_file(fname):
-        parser = Parser(oseer, txt_file, prefix)
         print("Processing", fname)
         try:
             parser.process_file(img_dir + fname)
@@ -60,16 +104,20 @@ if 1:
         print("Done ", fname)
         return fname, "Success"
 
-    file_list = [f for f in os.listdir(img_dir) if f.endswith('.box')]
-    file_list = tuple(sorted(file_list))
-    pool = multiprocessing.Pool(8)
-    returns = pool.map(process_file, file_list, chunksize=1)
+    file_list = get_file_list()
+    pool = multiprocessing.Pool(nworkers, init_worker, (log_queue,))
+    # One file at a time, bigger chunks would bundle the large files together
+    returns = sorted(pool.imap_unordered(process_file, file_list, chunksize=1))
+    # Let the workers flush their log records before the listener stops
+    pool.close()
+    pool.join()
     for f, e in returns:
         print(f)
         print(e)
+    log_listener.stop()
 
 else:
-    parser = Parser(oseer, txt_file, prefix)
+    init_worker(log_queue)
     file_list = [f for f in sorted(os.listdir(img_dir)) if f.endswith('.box')]
 
     for box_file_name in file_list:
@@ -82,4 +130,5 @@ else:
                 if inpt != 'y':
                     break
 
-    print(parser)
\ No newline at end of file
+    print(parser)
+    log_listener.stop()
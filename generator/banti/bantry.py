@@ -1,6 +1,9 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import logging
-from .glyph import Glyph
+from .glyph import Glyph, BasicGlyph
+from .boxfile import read_box_entries
+from .trace import event
 
 logger = logging.getLogger(__name__)
 logi = logger.info
@@ -14,6 +17,13 @@ def do_combine(self, other):
     :param Bantry other:
 0    :return:
     """
+    # Everything but spaces is combined for now. Decided before looking at
+    # best_char, so that merged glyphs do not have to be classified yet.
+    if other is Space:
+        return False
+    else:
+        return True
+
     score, yell = 0, ""
     s, t = self.best_char, other.best_char
     ss, st = self.strength(), other.strength()
@@ -28,10 +38,6 @@ def do_combine(self, other):
 
     lowprob = np.log(.95)
     vlprob = np.log(.70)
-    if other is Space:
-        return False
-    else:
-        return True
 
     # Strong rules resulting in immediate failure
     if s in heads and t[0] not in ghpsshh:
@@ -64,7 +70,7 @@ def do_combine(self, other):
         yell += '#OLNS'
 
     try:
-        self.ngram[self.best_char, other.best_char]
+        self.models.ngram[self.best_char, other.best_char]
     except KeyError:
         yell += '+DICT'
         score += 1
@@ -84,26 +90,95 @@ def do_combine(self, other):
     if score > 1:
         combined_area = self.combined_area(other)
         if combined_area < 3 * self.xarea:
-            logi("Combining 'cos: " + yell)
+            logi("Combining 'cos: %s", yell)
             return score > 1
         else:
-            logi("Combined Area too big: {}>3*{}".format(combined_area, self.xarea))
+            logi("Combined Area too big: %s>3*%s", combined_area, self.xarea)
 
 
 class Bantry(Glyph):
     """Class used to process a space seperated line and store the probable
     characters and the respective liklihoods for one glyph.
+    The scaler, classifier and ngram are taken from models, any object with
+    those attributes (like ocr.OCR). By default that is the class itself,
+    whose attributes the demos set.
     """
+    __slots__ = ('scaled', '_likelies', 'models')
     scaler = lambda *_: None
     classifier = lambda *_: (("", 0),)
     ngram = ()
 
-    def __init__(self, bantry_str=None):
+    def __init__(self, bantry_str=None, classify=True, models=None):
         super().__init__(bantry_str)
-        if bantry_str:
-            self.scaled = self.scaler(self)
-            self.likelies = self.classifier(self.scaled)
-            logd("Initialized\n{}".format(self))
+        self._likelies = None
+        self.models = Bantry if models is None else models
+        if bantry_str and classify:
+            self.classify()
+
+    def classify(self):
+        self.classify_all([self])
+
+    @property
+    def classified(self):
+        return self._likelies is not None
+
+    @property
+    def likelies(self):
+        # Merged bantries are classified only when somebody needs them
+        if self._likelies is None:
+            self.classify()
+        return self._likelies
+
+    @likelies.setter
+    def likelies(self, likelies):
+        self._likelies = likelies
+
+    @classmethod
+    def evaluate_many(cls, wts):
+        """
+        Classify, in one batch per models, those of wts that are not
+        classified yet.
+        """
+        by_models = {}
+        for wt in wts:
+            if isinstance(wt, Bantry) and not wt.classified:
+                by_models.setdefault(id(wt.models), []).append(wt)
+        for bantries in by_models.values():
+            cls.classify_all(bantries)
+
+    @staticmethod
+    def classify_all(bantries):
+        """
+        Scale and classify many bantries, all with the same models, with one
+        batched classifier call, when the classifier supports it.
+        """
+        if not bantries:
+            return
+
+        event(logger, 'classify_batch', size=len(bantries))
+        scaler = bantries[0].models.scaler
+        classifier = bantries[0].models.classifier
+        if hasattr(scaler, 'scale_batch') and \
+                hasattr(classifier, 'classify_batch'):
+            imgs, dtops, dbots = scaler.scale_batch(bantries)
+            for bantry, img, dtop, dbot in zip(bantries, imgs, dtops, dbots):
+                bantry.scaled = BasicGlyph((img[0], dtop, dbot))
+            all_likelies = classifier.classify_batch(
+                imgs, np.column_stack((dtops, dbots)))
+
+        else:
+            for bantry in bantries:
+                bantry.scaled = scaler(bantry)
+
+            scaleds = [bantry.scaled for bantry in bantries]
+            if hasattr(classifier, 'classify_glyphs'):
+                all_likelies = classifier.classify_glyphs(scaleds)
+            else:
+                all_likelies = [classifier(scaled) for scaled in scaleds]
+
+        for bantry, likelies in zip(bantries, all_likelies):
+            bantry.likelies = likelies
+            logd("Initialized\n%s", bantry)
 
     @property
     def best_char(self):
@@ -117,27 +192,99 @@ class Bantry(Glyph):
         return " ".join("{}{:.4f}".format(char, np.exp(lik)) for char, lik in self.likelies)
 
     def __str__(self):
+        if not self.classified:
+            return super().__str__() + "\n(not classified yet)"
         return super().__str__() + "\n" + self.strlikelies
 
     def __repr__(self):
+        if not self.classified:
+            return "(?)"
         return "({}: {})".format(self.best_char,
                                  int(100*np.exp(self.strength())))
 
     def combine(self, other):
-        logd("Checking to combine\n{}\n{}".format(self, other))
-
-        if do_combine(self, other):
-            combined = self + other
-            combined.scaled = self.scaler(combined)
-            combined.likelies = self.classifier(combined.scaled)
-            if logger.isEnabledFor(logging.DEBUG):
-                logi("Combining\n{}".format(combined))
+        return self.combine_many([(self, other)])[0]
+
+    @classmethod
+    def combine_many(cls, pairs):
+        """
+        Check many (left, right) pairs for combining. The merged glyphs are
+        not classified here, but in a batch when their likelies are first
+        needed (see evaluate_many).
+
+        :return: list of (do_combine, combined) as returned by combine
+        """
+        results = []
+        for left, right in pairs:
+            logd("Checking to combine\n%s\n%s", left, right)
+            if left is not Space and do_combine(left, right):
+                combined = left + right
+                combined.models = left.models
+                results.append((True, combined))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logd("Combining\n%s\n%s\n%s", left, right, combined)
             else:
-                logi("Combining\n{}\n{}\n{}".format(self, other, combined))
+                results.append((False, None))
 
-            return True, combined
-        else:
-            return False, None
+        return results
+
+
+class MergeFilter():
+    """
+    Cheap geometric test of which runs of glyphs on a line may be merged,
+    done before any merge is scaled and classified. A run of span glyphs
+    starting at i is allowed if
+        span <= max_span,
+        it has no Space,
+        its bounding box area < max_area * xarea of its first glyph, and
+        its glyphs overlap or are adjacent horizontally: each one starts
+        at most max_gap * xht right of where the ones before it end.
+    Checks set to None are skipped. It is not used unless asked for (see
+    OCR), as it can change the output.
+    """
+    def __init__(self, max_span=3, max_area=3., max_gap=.5):
+        self.max_span = max_span
+        self.max_area = max_area
+        self.max_gap = max_gap
+
+    def __call__(self, line_bantries):
+        """
+        :return: boolean table allowed[start, span] for the line
+        """
+        n = len(line_bantries)
+        max_span = n if self.max_span is None else min(self.max_span, n)
+        allowed = np.zeros((n + 1, max_span + 1), dtype=bool)
+        if max_span < 2:
+            return allowed
+
+        is_glyph = np.array([b is not Space for b in line_bantries])
+        boxes = np.array([(b.x, b.y, b.x2, b.y2, b.xht) if b is not Space
+                          else (0, 0, 0, 0, 0) for b in line_bantries],
+                         dtype=float)
+        x1, y1, x2, y2, xht = boxes.T
+
+        for span in range(2, max_span + 1):
+            def windows(arr):
+                return sliding_window_view(arr, span)
+
+            ok = windows(is_glyph).all(axis=1)
+            start_xht = xht[:n - span + 1]
+
+            if self.max_area is not None:
+                area = (windows(x2).max(axis=1) - windows(x1).min(axis=1)) * \
+                       (windows(y2).max(axis=1) - windows(y1).min(axis=1))
+                ok &= area < self.max_area * start_xht ** 2
+
+            if self.max_gap is not None:
+                # Gap between the x extent of the first j glyphs and the next
+                ends, starts = windows(x2), windows(x1)
+                reach = np.maximum.accumulate(ends[:, :-1], axis=1)
+                widest = (starts[:, 1:] - reach).max(axis=1)
+                ok &= widest <= self.max_gap * start_xht
+
+            allowed[:n - span + 1, span] = ok
+
+        return allowed
 
 
 class MetaSpace(type):
@@ -158,44 +305,53 @@ class Space(metaclass=MetaSpace):
         return False, None
 
 
-class BantryFile():
-    def __init__(self, name):
-        in_file = open(name)
-        self.file_bantries = []
-
-        iword, iline = 0, 0
-        line_bantries = []
-
-        for bantry_str in in_file:
-            e = Bantry(bantry_str)
-            if e.linenum == iline:
-                if e.wordnum > iword:
-                    iword = e.wordnum
-                    line_bantries.append(Space)
-                line_bantries.append(e)
-
-            elif e.linenum > iline:
-                self.file_bantries.append(line_bantries)
-                iword = 0
+def iter_line_bantries(name, models=None):
+    """
+    Read a box file one line at a time.
+    Yields the list of bantries on each line, with Space between words and
+    empty lists for lines with no glyphs, so only one line is held at once.
+    :param models: see Bantry
+    """
+    iword, iline = 0, 0
+    line_bantries = []
+
+    def classified(bantries):
+        Bantry.classify_all([b for b in bantries if b is not Space])
+        return bantries
+
+    for bantry_info in read_box_entries(name):
+        e = Bantry(bantry_info, classify=False, models=models)
+        if e.linenum == iline:
+            if e.wordnum > iword:
+                iword = e.wordnum
+                line_bantries.append(Space)
+            line_bantries.append(e)
+
+        elif e.linenum > iline:
+            yield classified(line_bantries)
+            iword = 0
+            iline += 1
+            while iline < e.linenum:
+                yield []
                 iline += 1
-                while iline < e.linenum:
-                    self.file_bantries.append([])
-                    iline += 1
-                line_bantries = [e]
+            line_bantries = [e]
 
-            else:
-                raise ValueError("Line number can not go down.")
+        else:
+            raise ValueError("Line number can not go down.")
 
-        self.file_bantries.append(line_bantries)
-        self.num_lines = len(self.file_bantries)
+    yield classified(line_bantries)
 
-        self.text = ""
-        for bantries_inline in self.file_bantries:
-            for bantree in bantries_inline:
-                self.text += bantree.best_char
-            self.text += "\n"
 
-        in_file.close()
+def line_text(line_bantries):
+    return "".join(bantree.best_char for bantree in line_bantries)
+
+
+class BantryFile():
+    def __init__(self, name, models=None):
+        self.file_bantries = list(iter_line_bantries(name, models))
+        self.num_lines = len(self.file_bantries)
+        self.text = "".join(line_text(bantries_inline) + "\n"
+                            for bantries_inline in self.file_bantries)
 
     def get_line_bantires(self, i):
         return self.file_bantries[i]
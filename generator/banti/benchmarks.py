@@ -0,0 +1,396 @@
+"""
+Micro-benchmarks for the hot spots of banti.
+Run from the generator directory as
+    python3 -m banti.benchmarks [name [args ...]]
+where name is one of the keys of BENCHMARKS (default: all, without args).
+"""
+import math
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+
+from .glyph import Glyph, unpack_sixpack, pack_sixpack
+
+
+def timed(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def random_pix(ht, wd, density=.3, seed=0):
+    rng = np.random.RandomState(seed)
+    return (rng.random_sample((ht, wd)) < density).astype(np.uint8)
+
+
+################################## Sixpack
+def loop_unpack_sixpack(sixpack, ht, wd):
+    pix = np.empty((ht, wd), dtype=np.uint8)
+    for ipix in range(ht * wd):
+        row, col, istr = ipix // wd, ipix % wd, ipix // 6
+        pix[row, col] = bool((ord(sixpack[istr]) - ord('0'))
+                             & (1 << (5 - (ipix % 6))))
+    return pix
+
+
+def loop_pack_sixpack(pix):
+    ht, wd = pix.shape
+    s = [ord('0') for i in range(math.ceil(ht * wd / 6))]
+    for row in range(ht):
+        for col in range(wd):
+            ipix = row * wd + col
+            s[ipix // 6] += pix[row][col] << (5 - (ipix % 6))
+    return ''.join(chr(i) for i in s)
+
+
+def bench_sixpack():
+    print("{:>9} {:>12} {:>12} {:>8} {:>12} {:>12} {:>8}".format(
+        "size", "loop dec us", "numpy dec us", "speedup",
+        "loop enc us", "numpy enc us", "speedup"))
+    for ht, wd in ((12, 8), (30, 24), (48, 40), (90, 70)):
+        pix = random_pix(ht, wd)
+        sixpack = loop_pack_sixpack(pix)
+        assert pack_sixpack(pix) == sixpack
+        assert np.array_equal(unpack_sixpack(sixpack, ht, wd), pix)
+
+        n = 200
+        tld = timed(lambda: loop_unpack_sixpack(sixpack, ht, wd), n)
+        tnd = timed(lambda: unpack_sixpack(sixpack, ht, wd), n)
+        tle = timed(lambda: loop_pack_sixpack(pix), n)
+        tne = timed(lambda: pack_sixpack(pix), n)
+        print("{:>9} {:12.1f} {:12.1f} {:8.1f} {:12.1f} {:12.1f} {:8.1f}".format(
+            "{}x{}".format(ht, wd), 1e6 * tld, 1e6 * tnd, tld / tnd,
+            1e6 * tle, 1e6 * tne, tle / tne))
+
+
+################################## Glyph union
+def loop_add(self, other):
+    spix, opix = self.pix, other.pix
+
+    def get_pixel_abs(g, pix, r, c):
+        if g.y <= r < g.y2 and g.x <= c < g.x2:
+            return pix[r - g.y, c - g.x]
+        return 0
+
+    x1, y1, x2, y2 = min(self.x, other.x), min(self.y, other.y), \
+                     max(self.x2, other.x2), max(self.y2, other.y2)
+    summ = Glyph()
+    summ.set_xy_xy((x1, y1, x2, y2))
+    summ.set_pix([[(get_pixel_abs(self, spix, r, c) or
+                    get_pixel_abs(other, opix, r, c))
+                   for c in range(x1, x2)] for r in range(y1, y2)])
+    return summ
+
+
+def random_glyph(x, ht, wd, seed):
+    g = Glyph(['', x, 10, wd, ht, 10 + ht, 10, 0, 0, None])
+    g.set_pix(random_pix(ht, wd, seed=seed))
+    return g
+
+
+def bench_union():
+    print("{:>9} {:>12} {:>12} {:>8} {:>14}".format(
+        "size", "loop us", "slices us", "speedup", "3-way union us"))
+    for ht, wd in ((12, 8), (30, 24), (48, 40)):
+        a, b, c = (random_glyph(i * wd // 2, ht, wd, i) for i in range(3))
+        assert np.array_equal(loop_add(a, b).pix, (a + b).pix)
+        assert np.array_equal((a + b + c).pix, Glyph.union((a, b, c)).pix)
+
+        n = 50
+        tl = timed(lambda: loop_add(a, b), n)
+        tn = timed(lambda: a + b, n)
+        t3 = timed(lambda: Glyph.union((a, b, c)), n)
+        print("{:>9} {:12.1f} {:12.1f} {:8.1f} {:14.1f}".format(
+            "{}x{}".format(ht, wd), 1e6 * tl, 1e6 * tn, tl / tn, 1e6 * t3))
+
+
+################################## Glyph memory
+def synthetic_box_lines(nglyphs=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    for i in range(nglyphs):
+        ht, wd = rng.randint(15, 60), rng.randint(10, 50)
+        pix = (rng.random_sample((ht, wd)) < .3).astype(np.uint8)
+        yield "{} {} {} {} {} {} {} {} {} {}\n".format(
+            'x', 30 * i, 20, wd, ht, 20 + ht, 25, i // 50, i // 5,
+            pack_sixpack(pix))
+
+
+def bench_memory(box_fname=None, scaler_fname='banti/library/rel48.scl'):
+    """
+    Memory of the glyphs of a real box file: as read (bit-packed), after
+    they are scaled for the classifier (what Bantry.classify_all does), and
+    once their pixels are unpacked (pix). Compared to a uint8 array per
+    glyph, which is what each glyph held before it was bit-packed.
+    """
+    from .scaler import ScalerFactory
+    if not box_fname:
+        print("Needs a box file made by bin/segmenter:\n"
+              "    python3 -m banti.benchmarks memory <file.box>")
+        return
+
+    with open(box_fname) as box_fp:
+        lines = box_fp.readlines()
+    scaler = ScalerFactory(scaler_fname)
+
+    tracemalloc.start()
+    glyphs = [Glyph(line) for line in lines]
+    packed, _ = tracemalloc.get_traced_memory()
+    scaler.scale_batch(glyphs)
+    # The scaler keeps index arrays per glyph size, not counted here
+    nsizes = len(scaler.index_maps)
+    scaler.index_maps.clear()
+    scaled, _ = tracemalloc.get_traced_memory()
+    for g in glyphs:
+        g.pix
+    unpacked, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    nglyphs = len(glyphs)
+    npixels = sum(g.ht * g.wd for g in glyphs)
+    print("Glyphs: {} from {}".format(nglyphs, box_fname))
+    print("Bytes per glyph, packed: {:.0f}".format(packed / nglyphs))
+    print("Bytes per glyph, after scaling: {:.0f} ({} glyph sizes)".format(
+        scaled / nglyphs, nsizes))
+    print("Bytes per glyph, pix unpacked: {:.0f}".format(unpacked / nglyphs))
+    print("Pixels per glyph (uint8 bytes): {:.0f}".format(npixels / nglyphs))
+
+
+################################## Scaler
+def bench_scaler(box_fname=None, scaler_fname='banti/library/rel48.scl'):
+    from PIL import Image
+    from .scaler import ScalerFactory
+    scaler = ScalerFactory(scaler_fname)
+    if box_fname:
+        with open(box_fname) as box_fp:
+            glyphs = [Glyph(line) for line in box_fp]
+    else:
+        glyphs = [Glyph(line) for line in synthetic_box_lines(500)]
+
+    imgs, dtops, dbots = scaler.scale_batch(glyphs)
+    singles = [scaler(g) for g in glyphs]
+    assert np.allclose(dtops, [g.dtop for g in singles])
+    assert np.allclose(dbots, [g.dbot for g in singles])
+    diff = np.mean([np.mean(img[0] != g.pix) for img, g in zip(imgs, singles)])
+    print("Pixels differing from __call__ (Pillow default resample): "
+          "{:.3%}".format(diff))
+
+    class NearestGlyph():
+        def __init__(self, glp):
+            self.glp = glp
+            self.img = glp.img
+
+        def __getattr__(self, name):
+            return getattr(self.glp, name)
+
+    resize = Image.Image.resize
+    Image.Image.resize = lambda img, size: resize(img, size, Image.NEAREST)
+    try:
+        nearest = [scaler(NearestGlyph(g)) for g in glyphs]
+    finally:
+        Image.Image.resize = resize
+    ndiff = sum(np.sum(img[0] != g.pix) for img, g in zip(imgs, nearest))
+    print("Pixels differing from __call__ with NEAREST resample: {}".format(ndiff))
+
+    t1 = timed(lambda: [scaler(g) for g in glyphs], 3)
+    tb = timed(lambda: scaler.scale_batch(glyphs), 3)
+    print("Per glyph: one by one {:.1f}us, batch {:.1f}us, speedup {:.1f}".format(
+        1e6 * t1 / len(glyphs), 1e6 * tb / len(glyphs), t1 / tb))
+
+
+################################## Line graph
+class SpanWeight():
+    """Deterministic stand-in for Bantry: merges up to three pieces."""
+    def __init__(self, val, span=1):
+        self.val, self.span = val, span
+
+    def combine(self, other):
+        do = (7 * self.val + 3 * other.val) % 10 < 4 and \
+             self.span + other.span <= 3
+        return do, SpanWeight(self.val + other.val, self.span + other.span)
+
+    def strength(self):
+        return -(self.val % 13) / 13
+
+
+def synthetic_line_graph(n, seed=0):
+    from .linegraph import LineGraph
+    rng = np.random.RandomState(seed)
+    return LineGraph([SpanWeight(v) for v in rng.randint(1, 100, n)])
+
+
+def bench_linegraph(*sizes):
+    sizes = [int(n) for n in sizes] or (50, 500, 5000)
+    print("{:>6} {:>8} {:>14} {:>18}".format(
+        "glyphs", "edges", "process_tree s", "strongest_path s"))
+    for n in sizes:
+        lg = synthetic_line_graph(n)
+        start = time.time()
+        lg.process_tree()
+        tp = time.time() - start
+        start = time.time()
+        lg.strongest_path()
+        ts = time.time() - start
+        print("{:6} {:8} {:14.4f} {:18.4f}".format(
+            n, sum(len(c) for c in lg.lchildren), tp, ts))
+
+
+################################## Ngram decoding
+class HashGram():
+    """Deterministic stand-in for Ngram: pseudo random log-probabilities."""
+    def __init__(self, n=3):
+        self.n = n
+
+    def __call__(self, glyphs):
+        import zlib
+        glyphs = glyphs[-self.n:]
+        return -(zlib.crc32('|'.join(glyphs).encode('utf-8')) % 800) / 100
+
+
+class LikelyWeight(SpanWeight):
+    """SpanWeight with a few candidate characters and their likelihoods."""
+    chars = [chr(ord('a') + i) for i in range(26)]
+
+    def __init__(self, val, span=1):
+        super().__init__(val, span)
+        rng = np.random.RandomState(val)
+        self.likelies = [(self.chars[i], lik) for i, lik in zip(
+            rng.choice(26, 5, replace=False), np.log(rng.dirichlet(np.ones(5))))]
+
+    def combine(self, other):
+        do, wt = super().combine(other)
+        return do, LikelyWeight(wt.val, wt.span)
+
+    def strength(self):
+        return max(lik for _, lik in self.likelies)
+
+    @property
+    def strlikelies(self):
+        return str(self.likelies)
+
+
+def bench_beam(nlines=20, nglyphs=30, *beams):
+    from .ngramgraph import GramGraph
+    nlines, nglyphs = int(nlines), int(nglyphs)
+    beams = [int(b) for b in beams] or (1, 4, 16, 64)
+    rng = np.random.RandomState(0)
+    lines = [[LikelyWeight(v) for v in rng.randint(1, 10**6, nglyphs)]
+             for _ in range(nlines)]
+
+    def decode(beam_width):
+        strs = []
+        for wts in lines:
+            gg = GramGraph(wts, beam_width=beam_width, ngram=HashGram())
+            gg.process_tree()
+            strs.append(gg.get_best_str())
+        return strs
+
+    start = time.time()
+    full = decode(None)
+    print("{:>6} {:>10} {:>10}".format("beam", "seconds", "agreement"))
+    print("{:>6} {:10.3f} {:>10}".format("full", time.time() - start, "-"))
+    for beam in beams:
+        start = time.time()
+        strs = decode(beam)
+        print("{:6} {:10.3f} {:10.1%}".format(
+            beam, time.time() - start,
+            np.mean([s == f for s, f in zip(strs, full)])))
+
+
+def bench_pathmem(*sizes):
+    from .ngramgraph import GramGraph
+    sizes = [int(n) for n in sizes] or (100, 300, 1000)
+    rng = np.random.RandomState(0)
+    print("{:>6} {:>16} {:>16}".format("glyphs", "peak MB (keep)", "peak MB (free)"))
+    for n in sizes:
+        wts = [LikelyWeight(v) for v in rng.randint(1, 10**6, n)]
+        peaks = []
+        for free_paths in (False, True):
+            gg = GramGraph(wts, beam_width=64, free_paths=free_paths,
+                           ngram=HashGram())
+            gg.process_tree()
+            tracemalloc.start()
+            gg.get_best_str()
+            peaks.append(tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.stop()
+        print("{:6} {:16.1f} {:16.1f}".format(n, *peaks))
+
+
+def synthetic_ngram_file(fname, n=3, ntokens=50000, seed=0):
+    """Pickle n-gram counts (as read by Ngram) of skewed random text."""
+    import pickle
+    rng = np.random.RandomState(seed)
+    chars = LikelyWeight.chars
+    probs = rng.dirichlet(np.ones(len(chars)) / 2)
+    text = [chars[i] for i in rng.choice(len(chars), ntokens, p=probs)]
+    counts = [{} for _ in range(n)]
+    for i in range(len(text)):
+        for order in range(min(n, i + 1)):
+            dictionary = counts[order]
+            for g in text[i - order:i]:
+                dictionary = dictionary.setdefault(g, {})
+            dictionary[text[i]] = dictionary.get(text[i], 0) + 1
+    with open(fname, 'wb') as fp:
+        pickle.dump(counts, fp)
+
+
+def bench_ngram(nlines=20, nglyphs=30, beam_width=16):
+    import tempfile
+    from .ngram import Ngram
+    from .ngramfile import MappedNgram, write
+    from .ngramgraph import GramGraph
+    nlines, nglyphs, beam_width = int(nlines), int(nglyphs), int(beam_width)
+    with tempfile.NamedTemporaryFile(suffix='.pkl') as fp:
+        synthetic_ngram_file(fp.name)
+        start = time.time()
+        ngram = Ngram(fp.name)
+        print("Unpickled in {:.3f}s".format(time.time() - start))
+    start = time.time()
+    compiled = ngram.compile()
+    print("Compiled {} n-grams in {:.3f}s".format(len(compiled.keys),
+                                                  time.time() - start))
+    with tempfile.NamedTemporaryFile(suffix='.ngb') as fp:
+        write(compiled, fp.name)
+        start = time.time()
+        mapped = MappedNgram(fp.name)
+        print("Mapped in {:.3f}s".format(time.time() - start))
+
+    rng = np.random.RandomState(0)
+    lines = [[LikelyWeight(v) for v in rng.randint(1, 10**6, nglyphs)]
+             for _ in range(nlines)]
+
+    print("{:>10} {:>10}".format("model", "seconds"))
+    outputs = []
+    for name, model, vectorized in (("dicts", ngram, False),
+                                    ("compiled", compiled, False),
+                                    ("mapped", mapped, False),
+                                    ("arrays", compiled, True)):
+        graphs = [GramGraph(wts, beam_width=beam_width, vectorized=vectorized,
+                            ngram=model) for wts in lines]
+        for gg in graphs:
+            gg.process_tree()
+            gg.evaluate_edges()
+        start = time.time()
+        outputs.append([gg.get_best_str() for gg in graphs])
+        print("{:>10} {:10.3f}".format(name, time.time() - start))
+    print("Same output:", all(out == outputs[0] for out in outputs))
+
+
+BENCHMARKS = {
+    "beam": bench_beam,
+    "linegraph": bench_linegraph,
+    "memory": bench_memory,
+    "pathmem": bench_pathmem,
+    "ngram": bench_ngram,
+    "scaler": bench_scaler,
+    "sixpack": bench_sixpack,
+    "union": bench_union,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        print("*" * 20, sys.argv[1])
+        BENCHMARKS[sys.argv[1]](*sys.argv[2:])
+    else:
+        for name in sorted(BENCHMARKS):
+            print("*" * 20, name)
+            BENCHMARKS[name]()
@@ -0,0 +1,124 @@
+"""
+Binary, memory-mappable box files.
+
+Layout (all little endian)
+    header  : magic, version, number of glyphs, size of the text blob
+    records : one RECORD_DTYPE row per glyph
+    text    : utf-8 encoded text columns, addressed by text_off, text_len
+    bits    : np.packbits'd bitmaps, addressed by bits_off,
+              each ceil(wd*ht/8) bytes long
+
+Convert a text box file with
+    python3 -m banti.boxfile <in.box> [out.boxb]
+"""
+import mmap
+import struct
+import numpy as np
+
+from .glyph import unpack_sixpack
+
+MAGIC = b'BBOX'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+RECORD_DTYPE = np.dtype([('x', '<i4'), ('y', '<i4'),
+                         ('wd', '<i4'), ('ht', '<i4'),
+                         ('baseline', '<i4'), ('topline', '<i4'),
+                         ('linenum', '<i4'), ('wordnum', '<i4'),
+                         ('text_off', '<u4'), ('text_len', '<u4'),
+                         ('bits_off', '<u8')])
+BINARY_EXT = '.boxb'
+
+
+def is_binary_box(name):
+    with open(name, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def convert(text_fname, bin_fname=None):
+    """
+    Convert a whitespace separated box file to the binary format.
+
+    :return: name of the binary file written
+    """
+    if bin_fname is None:
+        bin_fname = text_fname.rsplit('.', 1)[0] + BINARY_EXT
+
+    with open(text_fname) as text_fp:
+        lines = [line.split() for line in text_fp if line.strip()]
+
+    records = np.zeros(len(lines), dtype=RECORD_DTYPE)
+    texts, bitmaps = [], []
+    text_off, bits_off = 0, 0
+    for i, fields in enumerate(lines):
+        text = fields[0].encode('utf-8')
+        ints = [int(v) for v in fields[1:9]]
+        sixpack = fields[9] if len(fields) > 9 else ''
+        wd, ht = ints[2], ints[3]
+        bits = np.packbits(unpack_sixpack(sixpack, ht, wd), axis=None)
+
+        records[i] = tuple(ints) + (text_off, len(text), bits_off)
+        texts.append(text)
+        bitmaps.append(bits.tobytes())
+        text_off += len(text)
+        bits_off += len(bitmaps[-1])
+
+    with open(bin_fname, 'wb') as bin_fp:
+        bin_fp.write(HEADER.pack(MAGIC, VERSION, len(records), text_off))
+        bin_fp.write(records.tobytes())
+        bin_fp.write(b''.join(texts))
+        bin_fp.write(b''.join(bitmaps))
+
+    return bin_fname
+
+
+class BinaryBoxFile():
+    """
+    Memory-mapped reader for the binary box format.
+    Iterating yields box lists as understood by Glyph.init_from_list, with
+    the bitmap as a packed uint8 view into the mapping instead of a sixpack.
+    """
+    def __init__(self, name):
+        with open(name, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, nglyphs, text_nbytes = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} binary box file"
+                             "".format(name, VERSION))
+
+        text_start = HEADER.size + nglyphs * RECORD_DTYPE.itemsize
+        bits_start = text_start + text_nbytes
+        self.records = np.frombuffer(self.mm, RECORD_DTYPE, nglyphs,
+                                     HEADER.size)
+        self.text_bytes = self.mm[text_start:bits_start]
+        self.bits = np.frombuffer(self.mm, np.uint8, offset=bits_start)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        x, y, wd, ht, baseline, topline, linenum, wordnum, \
+            text_off, text_len, bits_off = self.records[i].tolist()
+        text = self.text_bytes[text_off:text_off + text_len].decode('utf-8')
+        bits = self.bits[bits_off:bits_off + (wd * ht + 7) // 8]
+        return [text, x, y, wd, ht, baseline, topline, linenum, wordnum, bits]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def read_box_entries(name):
+    """
+    Iterate over the glyph entries of a text or binary box file.
+    """
+    if is_binary_box(name):
+        yield from BinaryBoxFile(name)
+    else:
+        with open(name) as in_file:
+            yield from in_file
+
+
+if __name__ == '__main__':
+    import sys
+    print("Wrote", convert(*sys.argv[1:3]))
@@ -1,4 +1,9 @@
+import hashlib
+import os
 import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
 import numpy as np
 from theanet.neuralnet import NeuralNet
 from .iast_unicodes import LabelToUnicodeConverter
@@ -9,43 +14,255 @@ logd = logger.debug
 
 
 class Classifier():
-    def __init__(self, nnet_prms_file, labellings_file, logbase=2, only_top=5):
+    def __init__(self, nnet_prms_file, labellings_file, logbase=2, only_top=5,
+                 batch_sz=1):
         with open(nnet_prms_file, 'rb') as nnet_prms_fp:
             nnet_prms = pickle.load(nnet_prms_fp)
 
-        nnet_prms['training_params']['BATCH_SZ'] = 1
+        nnet_prms['training_params']['BATCH_SZ'] = batch_sz
+        self.nnet_prms_file = nnet_prms_file
+        self.labellings_file = labellings_file
         self.ntwk = NeuralNet(**nnet_prms)
         self.tester = self.ntwk.get_data_test_model()
         self.ht = nnet_prms['layers'][0][1]['img_sz']
+        self.batch_sz = batch_sz
         self.logbase = logbase
         self.only_top = only_top
 
         self.unichars = LabelToUnicodeConverter(labellings_file)
         self.nclasses = nnet_prms['layers'][-1][1]["n_out"]
+        # Compiled testers are not reentrant, so threads take turns
+        self.lock = threading.Lock()
 
-        logi("Network {}".format(self.ntwk))
-        logi("LogBase {}".format(self.logbase))
-        logi("OnlyTop {}".format(self.only_top))
+        logi("Network %s", self.ntwk)
+        logi("LogBase %s", self.logbase)
+        logi("OnlyTop %s", self.only_top)
+        logi("BatchSize %s", self.batch_sz)
+
+    def fingerprint(self):
+        """
+        :return: string that changes with anything the likelies depend on,
+            to salt CachedClassifier's keys
+        """
+        with open(self.labellings_file, 'rb') as lbl_fp:
+            labels_hash = hashlib.sha1(lbl_fp.read()).hexdigest()
+        return '{} {} {} {} {}'.format(
+            os.path.basename(self.nnet_prms_file),
+            os.path.getmtime(self.nnet_prms_file),
+            labels_hash, self.logbase, self.only_top)
 
     def __call__(self, scaled_glp):
-        img = scaled_glp.pix.astype('float32').reshape((1, 1, self.ht, self.ht))
+        return self.classify_glyphs([scaled_glp])[0]
 
-        if self.ntwk.takes_aux():
-            dtopbot = scaled_glp.dtop, scaled_glp.dbot
-            aux_data = np.array([[dtopbot, dtopbot]], dtype='float32')
-            logprobs, preds = self.tester(img, aux_data)
-        else:
-            logprobs, preds = self.tester(img)
+    def classify_glyphs(self, scaled_glps):
+        """
+        Classify many scaled glyphs with as few network calls as possible.
+
+        :param scaled_glps: list of BasicGlyphs from the scaler
+        :return: list of likelies, one per glyph
+        """
+        if not scaled_glps:
+            return []
+        imgs = np.array([g.pix for g in scaled_glps], dtype='float32')
+        dtopbots = np.array([(g.dtop, g.dbot) for g in scaled_glps],
+                            dtype='float32')
+        return self.classify_batch(imgs, dtopbots)
+
+    def run_network(self, imgs, dtopbots):
+        """
+        :param imgs: float32 array of shape (N, 1, ht, ht)
+        :param dtopbots: float32 array of shape (N, 2)
+        :return: log-probabilities of shape (N, nclasses)
+        """
+        n = len(imgs)
+        nbatches = -(-n // self.batch_sz)
+        padded = nbatches * self.batch_sz
+
+        # The compiled tester works on whole batches; pad the last one
+        imgs_padded = np.zeros((padded, 1, self.ht, self.ht), dtype='float32')
+        imgs_padded[:n] = imgs
+        aux_padded = np.zeros((padded, 2, 2), dtype='float32')
+        aux_padded[:n] = dtopbots[:, None, :]
+
+        logprobs = []
+        for ib in range(nbatches):
+            batch = slice(ib * self.batch_sz, (ib + 1) * self.batch_sz)
+            with self.lock:
+                if self.ntwk.takes_aux():
+                    out = self.tester(imgs_padded[batch], aux_padded[batch])
+                else:
+                    out = self.tester(imgs_padded[batch])
+            logprobs.append(out[0])
+
+        return np.concatenate(logprobs)[:n]
 
-        logprobs = logprobs[0]/self.logbase
+    def classify_batch(self, imgs, dtopbots):
+        """
+        :param imgs: array of N scaled images, reshapeable to (N, 1, ht, ht)
+        :param dtopbots: array of shape (N, 2) with the dtop, dbot of each
+        :return: list of likelies, one per image
+        """
+        imgs = np.asarray(imgs, dtype='float32').reshape(
+            (-1, 1, self.ht, self.ht))
+        dtopbots = np.asarray(dtopbots, dtype='float32').reshape((-1, 2))
+        logprobs = self.run_network(imgs, dtopbots) / self.logbase
 
         if self.only_top:
-            decent = np.argpartition(logprobs, -self.only_top)[-self.only_top:]
+            decents = np.argpartition(logprobs, -self.only_top,
+                                      axis=1)[:, -self.only_top:]
             if logger.isEnabledFor(logging.INFO):
-                decent = decent[np.argsort(-logprobs[decent])]
+                order = np.argsort(-np.take_along_axis(logprobs, decents, 1),
+                                   axis=1)
+                decents = np.take_along_axis(decents, order, 1)
         else:
-            decent = np.arange(self.nclasses)
+            decents = np.broadcast_to(np.arange(self.nclasses),
+                                      logprobs.shape)
+
+        return [[(ch, lps[i])
+                 for i in decent
+                 for ch in self.unichars[i]]
+                for lps, decent in zip(logprobs, decents)]
+
+
+class CachedClassifier():
+    """
+    Content addressed cache in front of a Classifier.
+    Keys are hashes of the scaled pixels and dtop, dbot. Recently used
+    entries are kept in memory (LRU, at most cache_sz of them). If a
+    file name is given, entries are also stored in a sqlite database,
+    which can be shared by all the worker processes and by later runs.
+    All other attributes are looked up on the wrapped classifier.
+    Safe to use from many threads. The counters are all in glyphs.
+    """
+    def __init__(self, classifier, cache_sz=2**16, cache_fname=None,
+                 salt=None):
+        """
+        :param salt: mixed into the keys, defaults to the classifier's
+            fingerprint, so that stored likelies of other networks, labels
+            or settings are never returned
+        """
+        self.classifier = classifier
+        self.cache_sz = cache_sz
+        self.cache_fname = cache_fname
+        if salt is None:
+            salt = classifier.fingerprint()
+        self.salt = salt.encode('utf-8')
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.disk_hits, self.misses = 0, 0, 0
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if name == 'classifier':
+            raise AttributeError(name)
+        return getattr(self.classifier, name)
+
+    @property
+    def db(self):
+        # sqlite connections do not survive a fork and can not be shared by
+        # threads, so open one per process and thread
+        if self.cache_fname is None:
+            return None
+
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.db = sqlite3.connect(self.cache_fname, timeout=60)
+            local.db.execute('PRAGMA journal_mode=WAL')
+            local.db.execute('CREATE TABLE IF NOT EXISTS likelies '
+                             '(key BLOB PRIMARY KEY, val BLOB)')
+            local.pid = os.getpid()
+        return local.db
+
+    def key(self, img, dtopbot):
+        h = hashlib.sha1(self.salt)
+        h.update(np.asarray(img, dtype='float32').tobytes())
+        h.update(np.asarray(dtopbot, dtype='float32').tobytes())
+        return h.digest()
+
+    def remember(self, key, likelies):
+        with self.lock:
+            self.lru[key] = likelies
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.cache_sz:
+                self.lru.popitem(last=False)
+
+    def lookup_disk(self, keys):
+        if self.db is None or not keys:
+            return {}
+
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.db.execute(
+                'SELECT key, val FROM likelies WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk)
+            for key, val in rows:
+                found[bytes(key)] = pickle.loads(val)
+        return found
+
+    def store_disk(self, items):
+        if self.db is None or not items:
+            return
+
+        with self.db:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO likelies VALUES (?, ?)',
+                [(key, pickle.dumps(likelies)) for key, likelies in items])
+
+    def __call__(self, scaled_glp):
+        return self.classify_glyphs([scaled_glp])[0]
+
+    def classify_glyphs(self, scaled_glps):
+        if not scaled_glps:
+            return []
+        imgs = np.array([g.pix for g in scaled_glps], dtype='float32')
+        dtopbots = np.array([(g.dtop, g.dbot) for g in scaled_glps],
+                            dtype='float32')
+        return self.classify_batch(imgs, dtopbots)
+
+    def classify_batch(self, imgs, dtopbots):
+        imgs = np.asarray(imgs, dtype='float32')
+        dtopbots = np.asarray(dtopbots, dtype='float32').reshape((-1, 2))
+        keys = [self.key(img, dtopbot) for img, dtopbot in zip(imgs, dtopbots)]
+        results = [None] * len(keys)
+        missing = {}
+
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.lru:
+                    self.lru.move_to_end(key)
+                    results[i] = self.lru[key]
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        for key, likelies in self.lookup_disk(missing).items():
+            indices = missing.pop(key)
+            for i in indices:
+                results[i] = likelies
+            self.remember(key, likelies)
+            with self.lock:
+                self.disk_hits += len(indices)
+
+        if missing:
+            todo = list(missing)
+            with self.lock:
+                self.misses += sum(map(len, missing.values()))
+            firsts = [missing[key][0] for key in todo]
+            all_likelies = self.classifier.classify_batch(imgs[firsts],
+                                                          dtopbots[firsts])
+            for key, likelies in zip(todo, all_likelies):
+                for i in missing[key]:
+                    results[i] = likelies
+                self.remember(key, likelies)
+            self.store_disk(zip(todo, all_likelies))
+
+        return results
 
-        return [(ch, logprobs[i])
-                for i in decent
-                for ch in self.unichars[i]]
\ No newline at end of file
+    def __str__(self):
+        total = self.hits + self.disk_hits + self.misses
+        return "hits:{} disk_hits:{} misses:{} hit_rate:{:.1%} size:{}/{}" \
+               "".format(self.hits, self.disk_hits, self.misses,
+                         (self.hits + self.disk_hits) / max(total, 1),
+                         len(self.lru), self.cache_sz)
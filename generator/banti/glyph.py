@@ -1,4 +1,3 @@
-import math
 import numpy as np
 from PIL import Image as im
 import logging
@@ -17,6 +16,57 @@ def shade(val):
     return '+'
 
 
+SHADES = np.array(list('- .o0#+'))
+SHADE_EDGES = [0., .15, .35, .65, .85]
+
+
+def shade_rows(pix):
+    """
+    shade applied to a whole array at once
+    :return: list of strings, one per row
+    """
+    idx = np.digitize(pix, SHADE_EDGES)
+    idx[pix > 1.] = len(SHADES) - 1
+    return [''.join(row) for row in SHADES[idx]]
+
+
+SIXPACK_ZERO = ord('0')
+SIXPACK_WTS = np.array([32, 16, 8, 4, 2, 1], dtype=np.uint8)
+
+
+def unpack_sixpack(sixpack, ht, wd):
+    """
+    Decode a sixpacked string into a binary pixel array.
+    Each character holds six pixels (MSB first) as an offset from '0'.
+
+    :param str sixpack: the last column of a box file line
+    :return: uint8 array of shape (ht, wd) with ones for ink
+    """
+    npix = ht * wd
+    if not sixpack:
+        return np.zeros((ht, wd), dtype=np.uint8)
+
+    codes = np.frombuffer(sixpack.encode('latin-1'), dtype=np.uint8)
+    codes = (codes - SIXPACK_ZERO) & 0x3F
+    bits = np.unpackbits(codes[:, None], axis=1)[:, 2:]
+    return bits.ravel()[:npix].reshape((ht, wd))
+
+
+def pack_sixpack(pix):
+    """
+    Inverse of unpack_sixpack.
+
+    :param pix: 2D array of zeros and ones
+    :return: sixpacked string
+    """
+    flat = np.asarray(pix, dtype=np.uint8).ravel()
+    nsix = -(-flat.size // 6)
+    padded = np.zeros(6 * nsix, dtype=np.uint8)
+    padded[:flat.size] = flat
+    codes = padded.reshape((nsix, 6)).dot(SIXPACK_WTS) + SIXPACK_ZERO
+    return codes.astype(np.uint8).tobytes().decode('latin-1')
+
+
 class BasicGlyph():
     """
     Basic glyph just contains an Image, its top, bottom, xht, ht, wd
@@ -30,18 +80,25 @@ class BasicGlyph():
 
     def init_from_img_dtop_dbot(self, img, dtop, dbot):
         """
-        :param img: Pillow Image
+        :param img: Pillow Image or 2D array of ink
         :param int dtop: where the top line is going relative to top of image
         :param int dbot: relative bottom line
         :return: None
         """
-        self.img = img
         self.dtop = dtop
         self.dbot = dbot
-        self.wd, self.ht = self.img.size
+        if isinstance(img, np.ndarray):
+            # Already scaled pixels (ones for ink), eg. from a batch scaler.
+            # No image is built for these.
+            self.img = None
+            self.pix = img
+            self.ht, self.wd = self.pix.shape
+        else:
+            self.img = img
+            self.wd, self.ht = self.img.size
+            self.pix = np.array(img.convert('1').getdata(), np.uint8)
+            self.pix = 1 - (self.pix.reshape((self.ht, self.wd)) / 255.)
         self.xht = self.ht + self.dtop - self.dbot
-        self.pix = np.array(img.convert('1').getdata(), np.uint8)
-        self.pix = 1 - (self.pix.reshape((self.ht, self.wd)) / 255.)
 
     def init_from_img_dtop_dbot_pairs(self, img, dtopbot_pairs):
         """
@@ -55,11 +112,8 @@ class BasicGlyph():
     def __str__(self):
         ret = '-' * (self.wd + 2) + '\n'
 
-        for r in range(self.ht):
-            ret += '|'
-            for c in range(self.wd):
-                ret += shade(self.pix[r, c])
-            ret += '|\n'
+        for row in shade_rows(self.pix):
+            ret += '|' + row + '|\n'
 
         ret += '-' * (self.wd + 2) + '\n'
         ret += 'size:({}, {}) xht:{} dtop:{} dbot:{}'.format(
@@ -72,6 +126,19 @@ class BasicGlyph():
 
 
 class Glyph():
+    """
+    A glyph read from a box file. Pixels are kept bit-packed; the unpacked
+    array (pix), the PIL image (img) and the sixpack string are built on
+    demand from them. pix is unpacked once, on first use, and kept (read
+    only) until the pixels are set again or drop_pix is called. unpack()
+    and what is built on it (img, sixpack, union, the scalers) do not keep
+    it, so a glyph that is only classified stays packed; get_pixel reads
+    the packed bits directly.
+    """
+    __slots__ = ('text', 'x', 'y', 'wd', 'ht', 'x2', 'y2',
+                 'baseline', 'topline', 'linenum', 'wordnum',
+                 'dtop', 'dbot', 'xht', 'error', '_bits', '_shape', '_pix')
+
     def __init__(self, line_info=None):
         """
 
@@ -99,11 +166,14 @@ class Glyph():
         self.text, self.x, self.y, self.wd, self.ht, \
         self.baseline, self.topline, \
         self.linenum, self.wordnum, \
-        self.sixpack = box_list
+        sixpack = box_list
 
         self.fix_x2_y2()
         self.fix_dtop_dbot_xht()
-        self.pix_from_sixpack()
+        if isinstance(sixpack, np.ndarray):
+            self.set_bits(sixpack)
+        else:
+            self.pix_from_sixpack(sixpack)
 
     def fix_dtop_dbot_xht(self):
         # Diff top & Diff bottom
@@ -129,33 +199,69 @@ class Glyph():
         self.x, self.y, self.x2, self.y2 = xyxy
         self.fix_wh()
 
-    def pix_from_sixpack(self):
+    def pix_from_sixpack(self, sixpack):
         # Process the 6packed string
-        pix = np.empty((self.ht, self.wd), dtype=np.uint8)
+        self.set_pix(unpack_sixpack(sixpack, self.ht, self.wd))
 
-        if self.sixpack:
-            for ipix in range(self.ht * self.wd):
-                row, col, istr = ipix // self.wd, ipix % self.wd, ipix // 6
-                pix[row, col] = bool((ord(self.sixpack[istr]) - ord('0'))
-                                          & (1 << (5 - (ipix % 6))))
+    def set_pix(self, pix):
+        pix = np.asarray(pix)
+        self._shape = pix.shape
+        self._bits = np.packbits(pix.astype(bool), axis=None)
+        self._pix = None
 
-        self.set_pix(pix)
+    def set_bits(self, bits):
+        """
+        :param bits: np.packbits'd pixels of a ht x wd glyph, used as is
+        """
+        self._shape = self.ht, self.wd
+        self._bits = bits
+        self._pix = None
 
-    def set_pix(self, pix):
-        self.pix = np.array(pix, dtype=np.uint8)
-        self.img = im.fromarray(255 * (1 - self.pix))
+    def unpack(self):
+        """
+        :return: the pixels as a uint8 array, kept by the glyph only if pix
+            was read before
+        """
+        if self._pix is not None:
+            return self._pix
+        count = self._shape[0] * self._shape[1]
+        return np.unpackbits(self._bits, count=count).reshape(self._shape)
+
+    @property
+    def pix(self):
+        if self._pix is None:
+            pix = self.unpack()
+            pix.flags.writeable = False
+            self._pix = pix
+        return self._pix
+
+    def drop_pix(self):
+        """
+        Forget the unpacked pixels, keeping only the packed bits.
+        """
+        self._pix = None
+
+    @property
+    def img(self):
+        return im.fromarray(255 * (1 - self.unpack()))
+
+    @property
+    def sixpack(self):
+        return pack_sixpack(self.unpack())
 
     def sixpack_from_pix(self):
-        s = [ord('0') for i in range(math.ceil(self.ht * self.wd / 6))]
-        for row in range(self.ht):
-            for col in range(self.wd):
-                ipix = row * self.wd + col
-                isix = ipix // 6
-                s[isix] += self.pix[row][col] << (5 - (ipix % 6));
-        self.sixpack = ''.join(chr(i) for i in s)
+        return self.sixpack
 
     def get_pixel(self, row, col):
-        return self.pix[row, col]
+        if self._pix is not None:
+            return self._pix[row, col]
+
+        ht, wd = self._shape
+        if not (-ht <= row < ht and -wd <= col < wd):
+            raise IndexError("Pixel {} {} outside {}x{} glyph".format(
+                row, col, ht, wd))
+        i = (row % ht) * wd + col % wd
+        return (int(self._bits[i >> 3]) >> (7 - (i & 7))) & 1
 
     def get_pixel_abs(self, abs_row, abs_col):
         if self.y <= abs_row < self.y2 and self.x <= abs_col < self.x2:
@@ -164,18 +270,35 @@ class Glyph():
             return 0
 
     def __add__(self, other):
-        logd("Adding\n{}\n{}".format(self, other))
-        x1, y1, x2, y2 = min(self.x, other.x), min(self.y, other.y), \
-                         max(self.x2, other.x2), max(self.y2, other.y2)
-        summ = self.__class__()
+        return self.union((self, other))
+
+    @classmethod
+    def union(cls, glyphs):
+        """
+        Merge N glyphs into one, allocating the bounding box only once.
+        Text is concatenated; lines and numbering come from the first glyph.
+
+        :param glyphs: sequence of Glyphs (or subclasses), left to right
+        :return: new glyph of the same class as the first one
+        """
+        first = glyphs[0]
+        if logger.isEnabledFor(logging.DEBUG):
+            logd("Adding\n" + "\n".join(str(g) for g in glyphs))
+
+        x1, y1 = min(g.x for g in glyphs), min(g.y for g in glyphs)
+        x2, y2 = max(g.x2 for g in glyphs), max(g.y2 for g in glyphs)
+        pix = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        for g in glyphs:
+            pix[g.y - y1:g.y2 - y1, g.x - x1:g.x2 - x1] |= g.unpack()
+
+        summ = first.__class__()
         summ.set_xy_xy((x1, y1, x2, y2))
-        summ.set_pix([[(self.get_pixel_abs(r, c) or other.get_pixel_abs(r, c))
-              for c in range(x1, x2)] for r in range(y1, y2)])
+        summ.set_pix(pix)
 
-        summ.text = self.text + other.text
-        summ.baseline, summ.topline = self.baseline, self.topline
+        summ.text = ''.join(g.text for g in glyphs)
+        summ.baseline, summ.topline = first.baseline, first.topline
         summ.fix_dtop_dbot_xht()
-        summ.linenum, summ.wordnum = self.linenum, self.wordnum
+        summ.linenum, summ.wordnum = first.linenum, first.wordnum
 
         return summ
 
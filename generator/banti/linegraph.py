@@ -1,3 +1,4 @@
+import heapq
 import random
 import numpy as np
 import logging
@@ -8,7 +9,7 @@ logd = logger.debug
 
 
 class LineGraph():
-    def __init__(self, wts):
+    def __init__(self, wts, merge_filter=None):
         """
 
         :param wts: A list of edge wts to initialize the graph. Needs to
@@ -16,6 +17,9 @@ class LineGraph():
             combine: A function that takes in two wts and tells if they
         should be combined or not. Also returns the combined weight/edge.
             strength: An integer strength of path
+        :param merge_filter: Optional callable, like bantry.MergeFilter,
+        that returns a table allowed[start, span] of the runs of wts that
+        may be combined. Others are not even offered to combine.
         """
         self.lchildren = []
         for i, wt in enumerate(wts):
@@ -24,11 +28,20 @@ class LineGraph():
         self.last_node = len(self.lchildren)
         self.lchildren.append([])
 
-        self.processed = []
-        self.checked_gcs = []
+        self.merge_filter = merge_filter
+        self.merge_allowed = merge_filter(wts) if merge_filter else None
+        self.nfiltered = 0  # Runs the merge filter kept from combining
+
+        self.processed = set()
+        self.checked_gcs = set()
         self.path_strength_till = {}
+        self.best_parent = {}
         self.find_parents()
 
+    # Edges always go from a lower to a higher node index (merges only link
+    # a node to one of its grandchildren), so increasing index order is a
+    # topological order. The traversals below rely on that instead of
+    # recursing along the edges.
     def find_parents(self):
         self.lparents = [[] for _ in self.lchildren]
         for parent, children in enumerate(self.lchildren):
@@ -36,39 +49,95 @@ class LineGraph():
                 self.lparents[child].append([parent, wt])
 
     def process_node(self, idx):
-        if idx in self.processed:
-            logd("Already processed {}".format(idx))
-            return
+        """
+        Process idx and everything after it, children before parents.
+        """
+        for node in range(self.last_node, idx - 1, -1):
+            if node in self.processed:
+                logd("Already processed %s", node)
+            else:
+                self.check_grandchildren(node)
 
-        logd("Processing in {}".format(idx))
+    def check_grandchildren(self, idx):
+        logd("Processing in %s", idx)
         ichild = 0
         while ichild < len(self.lchildren[idx]):
-            chld_id, chld_wt = self.lchildren[idx][ichild]
-            self.process_node(chld_id)
-            logd("Processing back in {}".format(idx))
-
-            igrandchild = 0
-            while igrandchild < len(self.lchildren[chld_id]):
-                gc_id, gc_wt = self.lchildren[chld_id][igrandchild]
-                if (idx, gc_id) in self.checked_gcs:
-                    logd("Already checked {} ({}) {}".format(idx, chld_id, gc_id))
-                    igrandchild += 1
-                    continue
-
-                do_combine, new_wt = chld_wt.combine(gc_wt)
-                logd("Checked {} {} {} Got: {}".format(idx, chld_id, gc_id, do_combine))
-                self.checked_gcs.append((idx, gc_id))
-
+            # Children added by merges in this wave are checked in the next
+            wave = self.lchildren[idx][ichild:]
+            ichild = len(self.lchildren[idx])
+            pairs, gc_ids = [], []
+
+            for chld_id, chld_wt in wave:
+                for gc_id, gc_wt in self.lchildren[chld_id]:
+                    if (idx, gc_id) in self.checked_gcs:
+                        logd("Already checked %s (%s) %s", idx, chld_id, gc_id)
+                        continue
+
+                    self.checked_gcs.add((idx, gc_id))
+                    if not self.may_merge(idx, gc_id):
+                        logd("Filtered out %s (%s) %s", idx, chld_id, gc_id)
+                        self.nfiltered += 1
+                        continue
+
+                    pairs.append((chld_wt, gc_wt))
+                    gc_ids.append(gc_id)
+
+            for gc_id, (do_combine, new_wt) in zip(gc_ids,
+                                                   self.combine_pairs(pairs)):
+                logd("Checked %s %s Got: %s", idx, gc_id, do_combine)
                 if do_combine:
                     self.lchildren[idx].append([gc_id, new_wt])
-                    logi("Added {} to {}: {}".format(gc_id, idx, self.lchildren[idx]))
+                    logi("Added %s to %s: %s", gc_id, idx, self.lchildren[idx])
+
+        logd("Processed %s", idx)
+        self.processed.add(idx)
 
-                igrandchild += 1
+    def may_merge(self, start, end):
+        if self.merge_allowed is None:
+            return True
 
-            ichild += 1
+        span = end - start
+        return span < self.merge_allowed.shape[1] and \
+            bool(self.merge_allowed[start, span])
+
+    def merge_stats(self):
+        """
+        Classifier calls saved on this line so far: runs the merge filter
+        did not even offer to combine, and merged edges whose weights were
+        never evaluated (see evaluate_edges).
+        :return: (filtered runs, merged edges, merged edges not evaluated)
+        """
+        merged = [wt for node, children in enumerate(self.lchildren)
+                  for child, wt in children if child > node + 1]
+        unevaluated = sum(not getattr(wt, 'classified', True)
+                          for wt in merged)
+        return self.nfiltered, len(merged), unevaluated
+
+    def evaluate_edges(self, wts=None):
+        """
+        Give weights that defer their work (eg. classification of merged
+        Bantries) a chance to do it for all of wts, by default every edge,
+        in one go before they are used.
+        """
+        if wts is None:
+            wts = [wt for children in self.lchildren for _, wt in children]
+
+        for wt in wts:
+            if hasattr(wt, 'evaluate_many'):
+                wt.evaluate_many(wts)
+                return
+
+    @staticmethod
+    def combine_pairs(pairs):
+        """
+        Combine a list of (wt, wt) pairs. Weights that implement
+        combine_many get all the pairs at once, so they can batch the work.
+        """
+        for wt, _ in pairs:
+            if hasattr(wt, 'combine_many'):
+                return wt.combine_many(pairs)
 
-        logd("Processed {}".format(idx))
-        self.processed.append(idx)
+        return [wt.combine(other) for wt, other in pairs]
 
     @property
     def parents_info(self):
@@ -87,6 +156,10 @@ class LineGraph():
             logi(str(self))
 
     def get_paths(self, n=0):
+        """
+        Enumerate every path from n. Exponential in the length of the line,
+        see k_best_paths for long lines.
+        """
         if len(self.lchildren[n]) == 0:
             yield [n]
 
@@ -107,31 +180,85 @@ class LineGraph():
         return ret
 
     def strongest_path(self, node=None):
+        """
+        :return: strength of the strongest path from a root to node and
+            the path itself, as a list of nodes
+        """
         if node is None:
             node = self.last_node
 
-        logd("SP in {}".format(node))
-        if node in self.path_strength_till:
-            logd("SP already did {}".format(node))
+        self.evaluate_edges()
+        for n in range(node + 1):
+            if n in self.path_strength_till:
+                continue
 
-        elif len(self.lparents[node]) == 0:
-            self.path_strength_till[node] = 0, [node]
-            logd("SP at root {}".format(node))
+            if len(self.lparents[n]) == 0:
+                self.path_strength_till[n] = 0
+                self.best_parent[n] = None
+                logd("SP at root %s", n)
+                continue
 
-        else:
-            best_strength, best_path = -np.inf, []
-            for parent, wt in self.lparents[node]:
-                strength, path_till = self.strongest_path(parent)
-                strength += wt.strength()
+            best_strength, best_parent = -np.inf, None
+            for parent, wt in self.lparents[n]:
+                strength = self.path_strength_till[parent] + wt.strength()
                 if strength > best_strength:
-                    best_strength = strength
-                    best_path = path_till
+                    best_strength, best_parent = strength, parent
+
+            self.path_strength_till[n] = best_strength
+            self.best_parent[n] = best_parent
+            logd("SP\tBest parent of node %s is %s(+%s)",
+                 n, best_parent, best_strength)
 
-            self.path_strength_till[node] = best_strength, best_path + [node]
-            logi("SP\tBest path at node {} is {}(+{})".format(
-                node, best_path, best_strength))
+        path = [node]
+        while self.best_parent[path[-1]] is not None:
+            path.append(self.best_parent[path[-1]])
 
-        return self.path_strength_till[node]
+        return self.path_strength_till[node], path[::-1]
+
+    def k_best_paths(self, k, node=None):
+        """
+        The k strongest paths from a root to node, strongest first.
+        Each node keeps its k best (strength, parent, rank of the path at
+        the parent) entries, found by lazily merging the sorted lists of
+        its parents with a heap. That is O(E + V k log E) instead of
+        enumerating every path. Ties are broken like strongest_path.
+
+        :return: list of (strength, path) pairs
+        """
+        if node is None:
+            node = self.last_node
+
+        self.evaluate_edges()
+        kbest = {}
+        for n in range(node + 1):
+            parents = self.lparents[n]
+            if len(parents) == 0:
+                kbest[n] = [(0, None, None)]
+                continue
+
+            strengths = [wt.strength() for _, wt in parents]
+            heap = [(-(kbest[parent][0][0] + strengths[i]), i, 0)
+                    for i, (parent, _) in enumerate(parents)]
+            heapq.heapify(heap)
+
+            kbest[n] = []
+            while heap and len(kbest[n]) < k:
+                neg_strength, i, rank = heapq.heappop(heap)
+                parent = parents[i][0]
+                kbest[n].append((-neg_strength, parent, rank))
+                if rank + 1 < len(kbest[parent]):
+                    heapq.heappush(heap, (-(kbest[parent][rank + 1][0] +
+                                            strengths[i]), i, rank + 1))
+
+        ret = []
+        for rank, (strength, _, _) in enumerate(kbest[node]):
+            path, n, r = [], node, rank
+            while n is not None:
+                path.append(n)
+                _, n, r = kbest[n][r]
+            ret.append((strength, path[::-1]))
+
+        return ret
 
     def __str__(self):
         ret = ""
@@ -31,7 +31,6 @@ class Ngram():
             return 0
 
         glyphs = glyphs[-self.n:]
-        looked_up = '|'.join(glyphs)
 
         denom, numer = 0, 0
         try:
@@ -47,9 +46,120 @@ class Ngram():
         else:
             ret = np.log(numer / denom)
 
-        logd('|{}| :\t{}/{}\te^{:.3f}'.format(looked_up, numer, denom, ret))
+        if logger.isEnabledFor(logging.DEBUG):
+            logd('|{}| :\t{}/{}\te^{:.3f}'.format('|'.join(glyphs),
+                                                  numer, denom, ret))
         return ret
 
+    def compile(self):
+        return CompiledNgram(self)
+
+
+def iter_counts(dictionary, prefix=()):
+    for key, val in dictionary.items():
+        if isinstance(val, dict):
+            yield from iter_counts(val, prefix + (key,))
+        else:
+            yield prefix + (key,), val
+
+
+class CompiledNgram():
+    """
+    Ngram with glyph labels mapped to small integers (from 1, the last one
+    standing for any unknown label) and the log-probability of every n-gram
+    precomputed. Scalar lookups go through a dict keyed on tuples of ids.
+    For vectorized ones, each n-gram is also packed into an int64,
+    (..(id1 * base + id2) * base + ..), with the log-probabilities in arrays
+    sorted by that key.
+    Gives the same values as Ngram.__call__, including -6 for an unseen
+    context and -12 for an unseen n-gram in a seen context.
+    """
+    unseen_context = -6
+    unseen_gram = -12
+
+    def __init__(self, ngram):
+        self.n = ngram.n
+        counts = [list(iter_counts(ngram.grams[order]))
+                  for order in range(1, self.n + 1)]
+        self.set_labels(sorted({g for grams in counts for gram, _ in grams
+                                for g in gram}))
+
+        self.table = {}
+        for grams in counts:
+            for gram, count in grams:
+                if not count:
+                    continue
+                try:
+                    denom = ngram[gram[:-1]]
+                except KeyError:
+                    denom = 0
+                self.table[self.encode(gram)] = \
+                    np.log(count / denom) if denom else self.unseen_context
+
+        packed = sorted((self.pack(ids), lp) for ids, lp in self.table.items())
+        self.keys = np.array([k for k, _ in packed], dtype=np.int64)
+        self.logprobs = np.array([lp for _, lp in packed])
+
+    def set_labels(self, labels):
+        self.ids = {label: i + 1 for i, label in enumerate(labels)}
+        self.labels = [None] + labels + [None]
+        self.unknown = len(labels) + 1
+        self.base = len(labels) + 2
+        if self.base ** self.n >= 2 ** 63:
+            raise ValueError("Vocabulary too big to pack {}-grams".format(self.n))
+
+    def encode(self, glyphs):
+        return tuple(self.ids.get(g, self.unknown) for g in glyphs)
+
+    def pack(self, ids):
+        key = 0
+        for i in ids:
+            key = key * self.base + i
+        return key
+
+    def logprob_ids(self, ids):
+        """
+        :param ids: tuple of glyph ids, the last one is being predicted
+        """
+        if len(ids) == 0:
+            return 0
+
+        ids = ids[-self.n:]
+        try:
+            return self.table[ids]
+        except KeyError:
+            pass
+
+        if len(ids) == 1 or ids[:-1] in self.table:
+            return self.unseen_gram
+        return self.unseen_context
+
+    def find_packed(self, packed):
+        """
+        Vectorized lookup of stored n-grams.
+        :param packed: int64 array of packed n-grams (see pack)
+        :return: float array of their log-probabilities, nan if not stored
+        """
+        packed = np.asarray(packed, dtype=np.int64)
+        if len(self.keys) == 0:
+            return np.full(packed.shape, np.nan)
+        idx = np.searchsorted(self.keys, packed)
+        idx[idx == len(self.keys)] = 0
+        return np.where(self.keys[idx] == packed, self.logprobs[idx], np.nan)
+
+    def __getitem__(self, glyphs):
+        """
+        :return: log-probability of a stored n-gram, KeyError if not stored
+        """
+        return self.table[self.encode(glyphs)]
+
+    def __call__(self, glyphs):
+        ret = self.logprob_ids(self.encode(glyphs))
+        if logger.isEnabledFor(logging.DEBUG):
+            logd('|{}| :\te^{:.3f}'.format('|'.join(glyphs[-self.n:]), ret))
+        return ret
+
+
 if __name__ == '__main__':
     logd = print
     ngram_file = "library/mega.123.pkl"
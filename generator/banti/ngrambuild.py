@@ -0,0 +1,231 @@
+"""
+Build the n-gram model read by banti.ngram.Ngram from unicode Telugu text.
+
+Text is put in glyph order (post_process.pre_process_parts) and split into the
+glyph labels the classifier outputs (LabelToUnicodeConverter.onecode), each
+line starting with a space like the decoder's histories do. Lines are
+counted in chunks by a pool of workers and merged as they come in. Whenever
+the merged table grows past max_grams entries, the rarest n-grams are
+dropped, so memory stays bounded whatever the size of the corpus.
+
+    python3 -m banti.ngrambuild <labellings.lbl> <out.pkl> <corpus.txt>..
+        [-n 3] [--workers N] [--update] [--max-grams N] [--min-count N]
+        [--binary]
+
+With --update, the counts already in out.pkl are added to, instead of
+counting everything again.
+"""
+import itertools
+import logging
+import multiprocessing
+import pickle
+import re
+from collections import Counter
+
+from .iast_unicodes import LabelToUnicodeConverter
+from .ngram import iter_counts
+from .post_process import pre_process_parts
+
+logger = logging.getLogger(__name__)
+logi = logger.info
+logd = logger.debug
+
+
+class GlyphSplitter():
+    """
+    Splits unicode text into glyph labels, longest match first within each
+    piece of pre_process_parts, except that a ్ followed by a consonant is
+    always the vattu, like the ్ల of పల్లవి, never the half form ల్.
+    Characters that are not part of any glyph are dropped; runs of white
+    space become one space.
+    """
+    def __init__(self, labellings):
+        unichars = LabelToUnicodeConverter(labellings)
+        self.spellings = {}
+        for index, unicodes in unichars.unicodes.items():
+            for uni in unicodes:
+                self.spellings[uni] = unichars.onecode[index]
+
+        # Glyphs like మెు are typed as మొ
+        for uni, label in list(self.spellings.items()):
+            typed = uni.replace('ెు', 'ొ').replace('ెా', 'ో').replace('ిా', 'ీ')
+            self.spellings.setdefault(typed, label)
+
+        self.maxlen = max(len(uni) for uni in self.spellings)
+
+    def __call__(self, text):
+        labels = []
+        for text in pre_process_parts(re.sub(r'\s+', ' ', text.strip())):
+            i = 0
+            while i < len(text):
+                for length in range(min(self.maxlen, len(text) - i), 0, -1):
+                    if text[i + length - 1] == '్' and \
+                            'క' <= text[i + length:i + length + 1] <= 'హ':
+                        continue
+                    label = self.spellings.get(text[i:i + length])
+                    if label is not None:
+                        labels.append(label)
+                        break
+                else:
+                    length = 1
+                    logd("Dropped {!r}".format(text[i]))
+                i += length
+        return labels
+
+
+def count_ngrams(labels, n, counts=None):
+    """
+    Count the 1 to n-grams of one line of glyph labels.
+    :return: Counter keyed by tuples of labels
+    """
+    if counts is None:
+        counts = Counter()
+    labels = [' '] + labels
+    for i in range(len(labels)):
+        for order in range(1, min(n, i + 1) + 1):
+            counts[tuple(labels[i - order + 1:i + 1])] += 1
+    return counts
+
+
+def prune(counts, max_grams):
+    """
+    Drop the rarest n-grams until at most max_grams remain. All orders are
+    cut at the same count, as a context is seen at least as often as the
+    n-grams that extend it.
+    :return: the count at or below which n-grams were dropped
+    """
+    threshold = 0
+    while len(counts) > max_grams:
+        threshold += 1
+        for gram in [g for g, c in counts.items() if c <= threshold]:
+            del counts[gram]
+    return threshold
+
+
+def read_model(pkl_fname):
+    with open(pkl_fname, 'rb') as fp:
+        loaded = pickle.load(fp)
+
+    counts = Counter()
+    for grams in loaded:
+        counts.update(dict(iter_counts(grams)))
+    return counts, len(loaded)
+
+
+def write_model(counts, n, pkl_fname):
+    """
+    Write counts in the format read by Ngram, a list of nested dicts.
+    """
+    model = [{} for _ in range(n)]
+    for gram, count in counts.items():
+        dictionary = model[len(gram) - 1]
+        for label in gram[:-1]:
+            dictionary = dictionary.setdefault(label, {})
+        dictionary[gram[-1]] = count
+
+    with open(pkl_fname, 'wb') as fp:
+        pickle.dump(model, fp)
+
+
+########################################## Workers
+splitter = None
+
+
+def init_worker(labellings):
+    global splitter
+    splitter = GlyphSplitter(labellings)
+
+
+def count_chunk(args):
+    lines, n = args
+    counts = Counter()
+    for line in lines:
+        count_ngrams(splitter(line), n, counts)
+    return counts
+
+
+def iter_chunks(corpus_fnames, chunk_lines):
+    for fname in corpus_fnames:
+        with open(fname, encoding='utf-8') as fp:
+            while True:
+                lines = list(itertools.islice(fp, chunk_lines))
+                if not lines:
+                    break
+                yield lines
+
+
+class NgramBuilder():
+    def __init__(self, labellings, n=3, workers=None, chunk_lines=2000,
+                 max_grams=2**22, min_count=1):
+        """
+        :param max_grams: most n-grams held while counting
+        :param min_count: drop n-grams seen fewer times from the final model
+        """
+        self.labellings = labellings
+        self.n = n
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk_lines = chunk_lines
+        self.max_grams = max_grams
+        self.min_count = min_count
+        self.counts = Counter()
+
+    def load(self, pkl_fname):
+        self.counts, n = read_model(pkl_fname)
+        if n != self.n:
+            raise ValueError("{} is a {}-gram model, not {}-gram"
+                             "".format(pkl_fname, n, self.n))
+
+    def add_corpus(self, corpus_fnames):
+        chunks = ((lines, self.n) for lines in
+                  iter_chunks(corpus_fnames, self.chunk_lines))
+        with multiprocessing.Pool(self.workers, init_worker,
+                                  (self.labellings,)) as pool:
+            # Hand out a few chunks at a time so the corpus is never all
+            # read in ahead of the counting
+            while True:
+                wave = list(itertools.islice(chunks, 2 * self.workers))
+                if not wave:
+                    break
+                for counts in pool.imap_unordered(count_chunk, wave):
+                    self.counts.update(counts)
+                if len(self.counts) > self.max_grams:
+                    threshold = prune(self.counts, self.max_grams // 2)
+                    logi("Pruned n-grams seen {} times or less".format(threshold))
+
+    def save(self, pkl_fname):
+        if self.min_count > 1:
+            for gram in [g for g, c in self.counts.items()
+                         if c < self.min_count]:
+                del self.counts[gram]
+        write_model(self.counts, self.n, pkl_fname)
+        logi("Wrote {} n-grams to {}".format(len(self.counts), pkl_fname))
+
+
+if __name__ == '__main__':
+    import argparse
+    from .ngramfile import convert
+
+    argparser = argparse.ArgumentParser(
+        description="Build an n-gram model of glyph labels from text.")
+    argparser.add_argument('labellings')
+    argparser.add_argument('model', help="pickle to write (and update)")
+    argparser.add_argument('corpus', nargs='+')
+    argparser.add_argument('-n', type=int, default=3)
+    argparser.add_argument('--workers', type=int, default=None)
+    argparser.add_argument('--update', action='store_true',
+                           help="add to the counts already in model")
+    argparser.add_argument('--max-grams', type=int, default=2**22)
+    argparser.add_argument('--min-count', type=int, default=1)
+    argparser.add_argument('--binary', action='store_true',
+                           help="also write the memory-mapped model")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    builder = NgramBuilder(args.labellings, args.n, args.workers,
+                           max_grams=args.max_grams, min_count=args.min_count)
+    if args.update:
+        builder.load(args.model)
+    builder.add_corpus(args.corpus)
+    builder.save(args.model)
+    if args.binary:
+        print("Wrote", convert(args.model))
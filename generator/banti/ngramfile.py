@@ -0,0 +1,141 @@
+"""
+Binary, memory-mappable n-gram models.
+
+Layout (all little endian)
+    header   : magic, version, n, number of labels, number of n-grams,
+               size of the labels blob
+    labels   : utf-8 encoded glyph labels separated by NUL, in id order
+    padding  : zeros up to a multiple of 8 bytes
+    keys     : int64 packed n-grams (see CompiledNgram.pack), sorted
+    logprobs : float64 log-probability of each key
+
+All processes opening the same file share its pages, and opening it does
+not depend on the size of the model.
+
+Convert a pickled model (as read by Ngram) with
+    python3 -m banti.ngramfile <in.pkl> [out.ngb]
+"""
+import bisect
+import mmap
+import struct
+import numpy as np
+
+from .ngram import Ngram, CompiledNgram
+
+MAGIC = b'BNGM'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIQQ')
+BINARY_EXT = '.ngb'
+
+
+def is_binary_ngram(name):
+    with open(name, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def write(compiled, bin_fname):
+    """
+    :param compiled: CompiledNgram to be saved
+    """
+    labels = '\0'.join(compiled.labels[1:-1]).encode('utf-8')
+    padding = -(HEADER.size + len(labels)) % 8
+    with open(bin_fname, 'wb') as bin_fp:
+        bin_fp.write(HEADER.pack(MAGIC, VERSION, compiled.n,
+                                 len(compiled.labels) - 2,
+                                 len(compiled.keys), len(labels)))
+        bin_fp.write(labels + b'\0' * padding)
+        bin_fp.write(compiled.keys.astype('<i8').tobytes())
+        bin_fp.write(compiled.logprobs.astype('<f8').tobytes())
+
+
+def convert(pkl_fname, bin_fname=None):
+    """
+    Convert a pickled n-gram model to the binary format.
+
+    :return: name of the binary file written
+    """
+    if bin_fname is None:
+        bin_fname = pkl_fname.rsplit('.', 1)[0] + BINARY_EXT
+
+    write(Ngram(pkl_fname).compile(), bin_fname)
+    return bin_fname
+
+
+class MappedNgram(CompiledNgram):
+    """
+    CompiledNgram read from the binary format. Only the labels are loaded;
+    the n-grams are looked up by binary search in the mapped arrays, with
+    the answers for recent id tuples remembered (up to memo_sz of them).
+    """
+    memo_sz = 2 ** 16
+
+    def __init__(self, name):
+        with open(name, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.n, nlabels, ngrams, labels_nbytes = \
+            HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} binary n-gram file"
+                             "".format(name, VERSION))
+
+        labels_end = HEADER.size + labels_nbytes
+        labels = self.mm[HEADER.size:labels_end].decode('utf-8')
+        self.set_labels(labels.split('\0') if nlabels else [])
+
+        keys_start = labels_end + -labels_end % 8
+        self.keys = np.frombuffer(self.mm, '<i8', ngrams, keys_start)
+        self.logprobs = np.frombuffer(self.mm, '<f8', ngrams,
+                                      keys_start + 8 * ngrams)
+        # Plain memoryviews for scalar lookups, bisect on them is much
+        # quicker than a numpy call per n-gram
+        self.key_view = memoryview(self.keys).cast('B').cast('q')
+        self.logprob_view = memoryview(self.logprobs).cast('B').cast('d')
+        self.memo = {}
+
+    def find(self, key):
+        """
+        :return: log-probability stored for the packed key, None if absent
+        """
+        i = bisect.bisect_left(self.key_view, key)
+        if i < len(self.key_view) and self.key_view[i] == key:
+            return self.logprob_view[i]
+
+    def logprob_ids(self, ids):
+        ids = ids[-self.n:]
+        try:
+            return self.memo[ids]
+        except KeyError:
+            pass
+
+        ret = self.find(self.pack(ids)) if ids else 0
+        if ret is None:
+            if len(ids) == 1 or self.find(self.pack(ids[:-1])) is not None:
+                ret = self.unseen_gram
+            else:
+                ret = self.unseen_context
+
+        if len(self.memo) >= self.memo_sz:
+            self.memo.clear()
+        self.memo[ids] = ret
+        return ret
+
+    def __getitem__(self, glyphs):
+        ret = self.find(self.pack(self.encode(glyphs)))
+        if ret is None:
+            raise KeyError(glyphs)
+        return ret
+
+
+def load_ngram(name):
+    """
+    :return: MappedNgram for a binary file, else a compiled pickled Ngram
+    """
+    if is_binary_ngram(name):
+        return MappedNgram(name)
+    return Ngram(name).compile()
+
+
+if __name__ == '__main__':
+    import sys
+    print("Wrote", convert(*sys.argv[1:3]))
@@ -1,7 +1,10 @@
 from collections import defaultdict
+from itertools import chain
 import logging
+import numpy as np
 
 from .linegraph import LineGraph
+from .trace import event
 
 
 logger = logging.getLogger(__name__)
@@ -9,24 +12,34 @@ logi = logger.info
 logd = logger.debug
 
 class PathNode():
-    order = 0
-    def __init__(self, likli=0, prior=0, chars=(" ",)):
+    """
+    One history in the lattice search. Only the characters added at this
+    step are stored, with a pointer to the previous PathNode; the full
+    string is rebuilt by following those pointers (see chars).
+    The key, given by the GramGraph, is the last ngram.n-1 characters, or
+    their ids when the ngram model is a CompiledNgram.
+    """
+    __slots__ = ('likli', 'prior', 'seg', 'prev', 'key')
+
+    def __init__(self, likli=0, prior=0, chars=(" ",), prev=None, key=None):
         self.likli, self.prior = likli, prior
-        self.chars = chars
+        self.seg, self.prev = chars, prev
+        if key is None:
+            key = (prev.key if prev else ()) + chars
+        self.key = key
 
     @property
-    def key(self):
-        return self.chars[-self.order:]
+    def chars(self):
+        segs, pn = [], self
+        while pn is not None:
+            segs.append(pn.seg)
+            pn = pn.prev
+        return tuple(chain.from_iterable(reversed(segs)))
 
     @property
     def post(self):
         return self.likli + self.prior
 
-    def __add__(self, other):
-        return PathNode(self.likli + other.likli,
-                        self.prior + other.prior,
-                        self.chars + other.chars)
-
     def __str__(self):
         return "{} L{:.3f}+R{:.3f}=T{:.3f}".format('|'.join(self.chars),
                                     self.likli, self.prior, self.post)
@@ -34,48 +47,186 @@ class PathNode():
 class GramGraph(LineGraph):
     ngram = lambda *_: 0
 
-    def __init__(self, line_bantries):
-        super().__init__(line_bantries)
+    def __init__(self, line_bantries, merge_filter=None,
+                 beam_width=None, beam_margin=None, free_paths=True,
+                 vectorized=None, ngram=None):
+        """
+        :param beam_width: keep at most this many histories per node
+        :param beam_margin: drop histories whose posterior is more than this
+            below the best one at the node
+        Leaving both as None searches all histories.
+        :param free_paths: forget the histories at a node once all its
+            children are grammed. Only the last node's are kept then.
+        :param vectorized: score the histories with array operations (see
+            gram_node_arrays), default is to when the ngram model allows it
+        :param ngram: Ngram, or better a CompiledNgram, in which case the
+            histories are keyed and looked up by glyph ids. Defaults to the
+            one given to set_ngram.
+        """
+        super().__init__(line_bantries, merge_filter)
+        self.beam_width = beam_width
+        self.beam_margin = beam_margin
+        self.free_paths = free_paths
+
+        if ngram is not None:
+            self.ngram = ngram
+        self.encode = getattr(self.ngram, 'encode', tuple)
+        self.logprob = getattr(self.ngram, 'logprob_ids', self.ngram)
+        self.order = getattr(self.ngram, 'n', 1) - 1
+        if vectorized is None:
+            vectorized = hasattr(self.ngram, 'find_packed') and self.order > 0
+        self.vectorized = vectorized
+        self.grammed = 0  # Nodes before this one are grammed
+        self.children_left = None  # Ungrammed children of each node
         self.paths_till = defaultdict(dict)  # paths_till[node]['a', 'b']
                                              # second key is a tuple/list of length ngram.n-1
 
     @classmethod
     def set_ngram(cls, ng):
+        """
+        Default ngram for the GramGraphs made without one.
+        """
         cls.ngram = ng
-        PathNode.order = ng.n - 1
 
     def find_top_ngram_paths(self, node=None):
         if node is None:
             node = self.last_node
+            self.evaluate_edges()
+
+        if self.children_left is None:
+            self.children_left = [len(children)
+                                  for children in self.lchildren]
+
+        # Nodes are in topological order, see LineGraph
+        for n in range(self.grammed, node + 1):
+            self.gram_node(n)
+            self.grammed = n + 1
+
+            for parent, _ in self.lparents[n]:
+                self.children_left[parent] -= 1
+                if self.free_paths and self.children_left[parent] == 0:
+                    self.paths_till.pop(parent, None)
 
-        logd("Graming at {}".format(node))
-        if node in self.paths_till:
-            logd("Already grammed {}".format(node))
+        return self.paths_till[node]
 
-        elif len(self.lparents[node]) == 0:
-            ppn = PathNode()
+    def gram_node(self, node):
+        logd("Graming at %s", node)
+        if len(self.lparents[node]) == 0:
+            ppn = PathNode(key=self.encode((" ",)))
             self.paths_till[node][ppn.key] = ppn
-            logd("Gramming root {}".format(node))
+            logd("Gramming root %s", node)
+
+        elif self.vectorized:
+            self.gram_node_arrays(node)
 
         else:
+            paths_till_node = self.paths_till[node]
             for parent, bantry in self.lparents[node]:
-                paths_till_parent = self.find_top_ngram_paths(parent)
-                logi(bantry.strlikelies)
+                paths_till_parent = self.paths_till[parent]
+                if logger.isEnabledFor(logging.INFO):
+                    logi(bantry.strlikelies)
+
+                likelies = bantry.likelies
+                ids = self.encode(char for char, _ in likelies)
 
                 for ppn_key, ppn in paths_till_parent.items():
-                    for char, likli in bantry.likelies:
-                        prior = self.ngram(ppn_key + (char,))
-                        pn = ppn + PathNode(likli, prior, (char,))
-                        if pn.key in self.paths_till[node]:
-                            if self.paths_till[node][pn.key].post > pn.post:
+                    for (char, likli), cid in zip(likelies, ids):
+                        key = ppn_key + (cid,)
+                        prior = self.logprob(key)
+                        pn = PathNode(ppn.likli + likli, ppn.prior + prior,
+                                      (char,), ppn, key[-self.order:])
+                        if pn.key in paths_till_node:
+                            if paths_till_node[pn.key].post > pn.post:
                                 continue
-                        self.paths_till[node][pn.key] = pn
+                        paths_till_node[pn.key] = pn
+
+            self.prune(node)
+
+        if logger.isEnabledFor(logging.INFO):
+            logi("Final Paths for node {}\n{}".format(
+                node, self.top_pathnodes_at(node)))
 
+    def gram_node_arrays(self, node):
+        """
+        Same as gram_node, for a CompiledNgram. The histories at the parents
+        and the candidate characters of the edges are held as packed ids, so
+        that their n-gram log-probabilities, posteriors and the best history
+        per key are all found with array operations. PathNodes are made only
+        for the histories that survive pruning.
+        """
+        ng = self.ngram
+        modulus = ng.base ** self.order
+        blocks = []  # the parent's histories and the edge's candidates
+        liklis, priors, keys, edges, hists, cands = [], [], [], [], [], []
+        for parent, bantry in self.lparents[node]:
             if logger.isEnabledFor(logging.INFO):
-                logi("Final Paths for node {}\n{}".format(
-                    node, self.top_pathnodes_at(node)))
+                logi(bantry.strlikelies)
+            pns = list(self.paths_till[parent].values())
+            chars = [char for char, _ in bantry.likelies]
+            cids = np.array(ng.encode(chars), dtype=np.int64)
+            cand_liklis = np.array([likli for _, likli in bantry.likelies])
+            hist_keys = np.array([ng.pack(pn.key) for pn in pns], dtype=np.int64)
 
-        return self.paths_till[node]
+            grams = hist_keys[:, None] * ng.base + cids
+            logprobs = ng.find_packed(grams)
+            unseen = np.where(np.isnan(ng.find_packed(hist_keys)),
+                              ng.unseen_context, ng.unseen_gram)
+            logprobs = np.where(np.isnan(logprobs), unseen[:, None], logprobs)
+
+            liklis.append((np.array([pn.likli for pn in pns])[:, None]
+                           + cand_liklis).ravel())
+            priors.append((np.array([pn.prior for pn in pns])[:, None]
+                           + logprobs).ravel())
+            keys.append((grams % modulus).ravel())
+            hists.append(np.repeat(np.arange(len(pns)), len(chars)))
+            cands.append(np.tile(np.arange(len(chars)), len(pns)))
+            edges.append(np.full(len(pns) * len(chars), len(blocks)))
+            blocks.append((pns, chars, cids))
+
+        likli, prior = np.concatenate(liklis), np.concatenate(priors)
+        key, post = np.concatenate(keys), likli + prior
+        edge = np.concatenate(edges)
+        hist, cand = np.concatenate(hists), np.concatenate(cands)
+
+        # Best per key; on a tie the later one wins, as in gram_node
+        order = np.lexsort((-np.arange(len(key)), -post, key))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key[order[1:]] != key[order[:-1]]
+        best = order[first]
+
+        ranked = best[np.argsort(-post[best], kind='stable')]
+        if self.beam_width is not None:
+            ranked = ranked[:self.beam_width]
+        if self.beam_margin is not None and len(ranked):
+            ranked = ranked[post[ranked] >= post[ranked[0]] - self.beam_margin]
+
+        paths_till_node = self.paths_till[node]
+        for i, li, pr in zip(ranked.tolist(), likli[ranked].tolist(),
+                             prior[ranked].tolist()):
+            pns, chars, cids = blocks[edge[i]]
+            ppn, c = pns[hist[i]], cand[i]
+            pn = PathNode(li, pr, (chars[c],), ppn,
+                          (ppn.key + (int(cids[c]),))[-self.order:])
+            paths_till_node[pn.key] = pn
+
+        event(logger, 'prune', node=node, kept=len(ranked), total=len(key))
+
+    def prune(self, node):
+        if self.beam_width is None and self.beam_margin is None:
+            return
+
+        paths = self.paths_till[node]
+        ranked = sorted(paths.items(), key=lambda kv: kv[1].post, reverse=True)
+        if self.beam_width is not None:
+            ranked = ranked[:self.beam_width]
+        if self.beam_margin is not None:
+            floor = ranked[0][1].post - self.beam_margin
+            ranked = [(key, pn) for key, pn in ranked if pn.post >= floor]
+
+        if len(ranked) < len(paths):
+            event(logger, 'prune', node=node, kept=len(ranked),
+                  total=len(paths))
+            self.paths_till[node] = dict(ranked)
 
     @property
     def top_final_pathnode(self):
@@ -116,6 +267,14 @@ class GramGraph(LineGraph):
         liklihood, most_likely = self.strongest_path()
         return self.get_path_chars(most_likely, join)
 
+    def get_k_best_apriori_strs(self, k, join=""):
+        """
+        :return: list of the k most likely (liklihood, segmentation string)
+            pairs, ignoring the ngram model
+        """
+        return [(liklihood, self.get_path_chars(path, join))
+                for liklihood, path in self.k_best_paths(k)]
+
 if __name__ == "__main__":
     import sys
     from scaler import ScalerFactory
@@ -134,15 +293,17 @@ if __name__ == "__main__":
     bf = BantryFile(banti_file_name)
 
     ngram = Ngram(ngram_file)
-    GramGraph.set_ngram(ngram)
+    GramGraph.set_ngram(ngram.compile())
 
     for linenum in range(bf.num_lines):
         print('*' * 80)
         bantires = bf.get_line_bantires(linenum)
-        gramgraph = GramGraph(bantires)
+        gramgraph = GramGraph(bantires, free_paths=False)
         gramgraph.process_tree()
         gramgraph.find_top_ngram_paths()
         for node, children in enumerate(gramgraph.lchildren):
             print(gramgraph.top_pathnodes_at(node, 1))
         print(gramgraph.get_best_str('|'))
         print(gramgraph.get_best_apriori_str('|'))
+        for liklihood, chars in gramgraph.get_k_best_apriori_strs(5, '|'):
+            print("{:.3f} {}".format(liklihood, chars))
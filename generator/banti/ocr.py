@@ -2,58 +2,117 @@ import logging
 
 from .ngramgraph import GramGraph
 from .scaler import ScalerFactory
-from .bantry import Bantry, BantryFile
-from .classifier import Classifier
-from .ngram import Ngram
+from .bantry import BantryFile, MergeFilter, iter_line_bantries
+from .classifier import Classifier, CachedClassifier
+from .ngramfile import load_ngram
+from . import trace
+
+logger = logging.getLogger(__name__)
 
 
 class OCR():
+    """
+    Holds the scaler, classifier, n-gram model and the merging and pruning
+    settings, and hands them to the bantries and graphs it makes, so that
+    OCRs with different models can be used side by side. One OCR can be
+    shared by threads.
+
+    An OCR leaves logging alone, as it is set for the whole process; the
+    scripts set it up, see trace.log_to_queue and trace.start_listener for
+    writing the records to <box file>.<level>.log.
+    """
     def __init__(self,
                  nnet_fname,
                  scaler_fname,
                  labels_fname,
                  ngram_fname,
                  logbase=1,
-                 loglevel=logging.INFO,):
+                 loglevel=logging.INFO,
+                 batch_sz=16,
+                 cache_sz=2**16,
+                 cache_fname=None,
+                 max_merge_span=None,
+                 max_merge_area=None,
+                 max_merge_gap=None,
+                 beam_width=None,
+                 beam_margin=None,):
+        """
+        :param max_merge_span, max_merge_area, max_merge_gap: settings of a
+            bantry.MergeFilter; with all of them None, the default, merges
+            are not filtered
+        :param beam_width, beam_margin: pruning of the n-gram search, see
+            ngramgraph.GramGraph; with both None, the default, all
+            histories are searched
+        """
         self.nnet_fname = nnet_fname
         self.scaler_fname = scaler_fname
         self.labels_fname = labels_fname
         self.ngram_fname = ngram_fname
         self.logbase = logbase
         self.loglevel = loglevel
-        self.loglevelname = logging._levelToName[loglevel].lower()
 
-        Bantry.scaler = ScalerFactory(scaler_fname)
-        Bantry.classifier = Classifier(nnet_fname, labels_fname,
-                                       logbase=logbase)
-        self.ng = Ngram(ngram_fname)
-        Bantry.ngram = self.ng
-        GramGraph.set_ngram(self.ng)
-        logging.basicConfig(level=self.loglevel,
-                            filename=None)
+        self.scaler = ScalerFactory(scaler_fname)
+        self.classifier = Classifier(nnet_fname, labels_fname,
+                                     logbase=logbase, batch_sz=batch_sz)
+        if cache_sz:
+            self.classifier = CachedClassifier(self.classifier, cache_sz,
+                                               cache_fname)
+        self.merge_filter = None
+        if (max_merge_span, max_merge_area, max_merge_gap) != (None,) * 3:
+            self.merge_filter = MergeFilter(max_merge_span, max_merge_area,
+                                            max_merge_gap)
+        self.beam_width = beam_width
+        self.beam_margin = beam_margin
+        self.ngram = load_ngram(ngram_fname)
 
     def ocr_box_file(self, box_fname):
-        # Set up the names of output files
-        replace = lambda s: box_fname.replace('.box', s)
-
-        log_fname = replace('.{}.log'.format(self.loglevelname))
-        log = logging.getLogger()  # root logger
-        print("Log : ", log_fname)
-        for hdlr in log.handlers[:]:  # remove all old handlers
-            # hdlr.stream.close()
-            log.removeHandler(hdlr)
-        log_fh = logging.FileHandler(log_fname, 'w')
-        log.addHandler(log_fh)
+        trace.set_box(box_fname)
 
         # Read Bantries & get Most likely output
-        bf = BantryFile(box_fname)
+        bf = BantryFile(box_fname, self)
 
         def get_gramgraph():
             # Process using ngrams
             for linenum in range(bf.num_lines):
-                line_bantries = bf.get_line_bantires(linenum)
-                gramgraph = GramGraph(line_bantries)
-                gramgraph.process_tree()
-                yield gramgraph
+                yield self.gramgraph(bf.get_line_bantires(linenum))
+
+        return bf, get_gramgraph()
+
+    def gramgraph(self, line_bantries):
+        gramgraph = GramGraph(line_bantries, self.merge_filter,
+                              self.beam_width, self.beam_margin,
+                              ngram=self.ngram)
+        gramgraph.process_tree()
+        return gramgraph
+
+    def stream_box_file(self, box_fname):
+        """
+        Pipelined version of ocr_box_file.
+        Yields (line_bantries, gramgraph) as soon as each line is read, so
+        only one line of the box file is in memory at a time. At the end,
+        logs the merges that were never classified (see
+        LineGraph.merge_stats), at DEBUG per line, and the cache statistics.
+        """
+        trace.set_box(box_fname)
+
+        filtered = merged = unevaluated = 0
+        for linenum, line_bantries in enumerate(
+                iter_line_bantries(box_fname, self)):
+            gramgraph = self.gramgraph(line_bantries)
+            yield line_bantries, gramgraph
+
+            # The caller is done with the line, what is left was never needed
+            nfiltered, nmerged, nunevaluated = gramgraph.merge_stats()
+            trace.event(logger, 'merges', line=linenum, filtered=nfiltered,
+                        merged=nmerged, unevaluated=nunevaluated)
+            filtered += nfiltered
+            merged += nmerged
+            unevaluated += nunevaluated
 
-        return bf, get_gramgraph()
\ No newline at end of file
+        trace.event(logger, 'merges', logging.INFO, filtered=filtered,
+                    merged=merged, unevaluated=unevaluated)
+        if isinstance(self.classifier, CachedClassifier):
+            cache = self.classifier
+            trace.event(logger, 'cache', logging.INFO, hits=cache.hits,
+                        disk_hits=cache.disk_hits, misses=cache.misses,
+                        size=len(cache.lru))
@@ -33,15 +33,93 @@ def post_process(content):
         (r'([ా-ూె-్])(్[క-హ‍])', r'\2\1'),
         ]
 
-    logi("In :" + content)
+    logi("In :%s", content)
     for find, replace in rules:
         content = re.sub(find, replace, content)
 
-    logi("Out : "  + content)
+    logi("Out : %s", content)
 
     return content
 
 
+# The aksharas of ఘపఫషసహ that are more than one glyph on the page, by how
+# they are split: the ✓ on top comes first, as do ి ీ ె ే and ్, and a
+# detached ై is a ె before and a ై after. Shared by the parser, which labels
+# the training glyphs, and pre_process, which puts the text of the n-grams in
+# glyph order, so that both split an akshara the same way.
+TICKED = ('ఘ ఘా ఘు ఘూ ఘొ ఘో ఘౌ ప పు పూ ఫ ఫు ఫూ ష షు షూ స సు సూ '
+          'హ హా హు హూ హొ హో హౌ').split()
+SIGN_FIRST = ('ఘి ఘీ ఘె ఘే ఘ్ పి పీ పె పే ప్ ఫి ఫీ ఫె ఫే ఫ్ షి షీ షె షే ష్ '
+              'సి సీ సె సే స్ హి హీ హె హే హ్').split()
+DETACHED_AI = 'ఘై పై ఫై షై సై హై'.split()
+
+
+def glyph_parts(akshara):
+    """
+    :param akshara: unicode akshara
+    :return: list of the glyphs of akshara, in the order they are on the page
+    """
+    if akshara in TICKED:
+        return ['✓', akshara]
+    if akshara in SIGN_FIRST:
+        return [akshara[1], akshara[0]]
+    if akshara in DETACHED_AI:
+        return ['ె', akshara[0], 'ై']
+    return [akshara]
+
+
+# An akshara of ఘపఫషసహ that glyph_parts may split, i.e. one that is not a
+# vattu, and has no vattu or other sign (like ం) after it
+SPLITTABLE = re.compile(r'(?<!్)[ఘపఫషసహ](?:్(?![క-హ])|[ా-ౌ])?'
+                        r'(?![ఀ-ఃా-్ౕౖౢౣ])')
+
+
+def pre_process_parts(content):
+    """
+    Undo post_process on logical unicode text, i.e. put the characters in
+    the order the glyphs appear on the page. Rules are the inverses of the
+    ones above, applied in reverse.
+    :param content: unicode text
+    :return: list of pieces of text in glyph order; each glyph of an akshara
+        split by glyph_parts is a piece of its own, as ్హ of హ్ would read
+        like the vattu ్హ otherwise
+    """
+    rules = [
+        # ౬) Vowel signs go before the vattulu, except the ు of ్పు
+        (r'(?!్పు)(్[క-హ])([ా-ౄె-ౌ])', r'\2\1'),
+        (r'(?!్పు)(్[క-హ])([ా-ౄె-ౌ])', r'\2\1'),
+
+        # ౪) ఏ is followed by an ఎ
+        (r'ఏ', r'ఏఎ'),
+
+        # ౨) కై is కె followed by ై, ఘపఫషసహ are done below
+        (r'(?![ఘపఫషసహ])([క-హ])ై', r'\1ెై'),
+        ]
+
+    for find, replace in rules:
+        content = re.sub(find, replace, content)
+
+    # ౧) ౩) ✓, ి ీ ె ే ్ and detached ై of ఘపఫషసహ
+    parts, last = [], 0
+    for match in SPLITTABLE.finditer(content):
+        if match.start() > last:
+            parts.append(content[last:match.start()])
+        parts.extend(glyph_parts(match.group()))
+        last = match.end()
+    if last < len(content):
+        parts.append(content[last:])
+
+    return parts
+
+
+def pre_process(content):
+    """
+    :param content: unicode text
+    :return: text in glyph order, see pre_process_parts
+    """
+    return ''.join(pre_process_parts(content))
+
+
 def impossible(chars):
     """
     Is a given sequence of labels impossible? Yes...suck it
@@ -1,7 +1,19 @@
+import numpy as np
 from PIL import Image
 from ..glyph import BasicGlyph
 
 
+def nearest_indices(src_sz, dst_sz):
+    """
+    Source index of each destination pixel, exactly as PIL's NEAREST resize
+    computes it (an accumulated float step, sampled at pixel centres).
+    """
+    step = float(src_sz) / dst_sz
+    steps = np.full(dst_sz, step)
+    steps[:1] = step / 2
+    return np.cumsum(steps).astype(np.intp)
+
+
 class Bunch(object):
     def __init__(self, adict):
         assert 'HT_MARGIN' in adict
@@ -17,6 +29,52 @@ class Bunch(object):
 class Relative():
     def __init__(self, params):
         self.params = Bunch(params)
+        self.index_maps = {}
+
+    def get_index_map(self, ht, wd, new_ht, new_wd):
+        key = ht, wd, new_ht, new_wd
+        if key not in self.index_maps:
+            self.index_maps[key] = (nearest_indices(ht, new_ht)[:, None],
+                                    nearest_indices(wd, new_wd)[None, :])
+        return self.index_maps[key]
+
+    def scale_batch(self, glps):
+        """
+        Scale many glyphs straight into one network input tensor.
+        Resampling is nearest neighbour and matches, pixel for pixel, what
+        __call__ gives when PIL resizes with NEAREST (the default before
+        Pillow 7). With the newer BICUBIC default, __call__ also dithers
+        edge pixels when pasting into the "1" canvas; benchmark scaler
+        reports how many pixels differ.
+
+        :param glps: list of Glyphs
+        :return: float32 array (N, 1, TOTHT, TOTWD) with ones for ink,
+            float arrays of the new dtops and dbots
+        """
+        p = self.params
+        n = len(glps)
+        imgs = np.zeros((n, 1, p.TOTHT, p.TOTWD), dtype=np.float32)
+        dtops = np.empty(n)
+        dbots = np.empty(n)
+
+        for i, glp in enumerate(glps):
+            scale = 1 / max(float(glp.wd)/p.WIDTH,
+                            float(glp.ht)/p.HEIGHT,
+                            float(glp.xht)/p.XHEIGHT)
+            new_wd = int(scale * glp.wd)
+            new_ht = int(scale * glp.ht)
+            move2x = p.WD_MARGIN + (p.WIDTH - new_wd)//2
+            move2y = p.HT_MARGIN + (p.HEIGHT - new_ht)//2
+
+            rows, cols = self.get_index_map(glp.ht, glp.wd, new_ht, new_wd)
+            imgs[i, 0, move2y:move2y + new_ht, move2x:move2x + new_wd] = \
+                glp.unpack()[rows, cols]
+
+            scalef = float(new_ht)/glp.ht
+            dtops[i] = glp.dtop * scalef - move2y
+            dbots[i] = glp.dbot * scalef - move2y + p.TOTHT - new_ht
+
+        return imgs, dtops, dbots
 
     def __call__(self, glp):
         p = self.params
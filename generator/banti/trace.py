@@ -0,0 +1,144 @@
+"""
+Logging for banti.
+
+Every module logs to its own logger (banti.bantry, banti.linegraph, ...), so
+each subsystem can be given its own level, see set_levels. Messages take
+%-style arguments, which are only formatted if the record is emitted, and
+event() records a structured event behind a single level check.
+
+The records of all processes go through one queue to a listener that writes
+those made while reading a box file to <box file>.<level>.log, see
+start_listener and log_to_queue.
+"""
+import logging
+import logging.handlers
+import os
+import threading
+from collections import OrderedDict
+
+LEVELS = {
+    'c': logging.CRITICAL,
+    'e': logging.ERROR,
+    'w': logging.WARNING,
+    'i': logging.INFO,
+    'd': logging.DEBUG}
+
+current = threading.local()
+
+
+def parse_level(level):
+    """
+    :param level: int, or name like 'debug' (only the first letter counts)
+    """
+    if isinstance(level, int):
+        return level
+    return LEVELS.get(level.lower()[0], logging.INFO)
+
+
+def set_levels(spec):
+    """
+    Set the level of each subsystem.
+    :param spec: dict, or string like "ngramgraph=debug,bantry=warning",
+        of module names under banti and their levels
+    """
+    if isinstance(spec, str):
+        spec = dict(item.split('=') for item in spec.split(',') if item)
+    for name, level in spec.items():
+        logging.getLogger('banti.' + name).setLevel(parse_level(level))
+
+
+def event(logger, name, level=logging.DEBUG, **fields):
+    """
+    Log a structured event. The fields are kept on the record (as
+    record.event, record.fields) and only formatted if it is emitted.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s %s", name, fields,
+                   extra={'event': name, 'fields': fields})
+
+
+def set_box(box_fname):
+    """
+    Records logged by this thread from now on belong to box_fname.
+    """
+    current.box = box_fname
+
+
+class BoxFilter(logging.Filter):
+    def filter(self, record):
+        record.box = getattr(current, 'box', None)
+        return True
+
+
+def log_to_queue(queue, level=logging.INFO, name='banti'):
+    """
+    Send the log records of the logger name (and those under it) to queue,
+    where a listener (see start_listener) picks them up, instead of passing
+    them on to the root logger. Other loggers are left alone. Works across
+    fork, as long as queue is a multiprocessing one.
+    """
+    handler = logging.handlers.QueueHandler(queue)
+    handler.addFilter(BoxFilter())
+    log = logging.getLogger(name)
+    for hdlr in log.handlers[:]:  # From an earlier call
+        if isinstance(hdlr, logging.handlers.QueueHandler):
+            log.removeHandler(hdlr)
+    log.addHandler(handler)
+    log.setLevel(parse_level(level))
+    log.propagate = False
+
+
+class BoxLogRouter(logging.Handler):
+    """
+    Writes each record to the log file of its box file, keeping at most
+    max_open files open. Records of no box file go to stderr.
+    """
+    max_open = 16
+
+    def __init__(self, level_name):
+        super().__init__()
+        self.level_name = level_name
+        self.files = OrderedDict()
+        self.seen = set()
+        self.fallback = logging.StreamHandler()
+
+    def log_fname(self, box_fname):
+        return os.path.splitext(box_fname)[0] + \
+               '.{}.log'.format(self.level_name)
+
+    def emit(self, record):
+        box = getattr(record, 'box', None)
+        if box is None:
+            self.fallback.handle(record)
+            return
+
+        handler = self.files.get(box)
+        if handler is None:
+            handler = logging.FileHandler(self.log_fname(box),
+                                          'a' if box in self.seen else 'w',
+                                          encoding='utf-8')
+            self.seen.add(box)
+            self.files[box] = handler
+            if len(self.files) > self.max_open:
+                self.files.popitem(last=False)[1].close()
+        self.files.move_to_end(box)
+        handler.handle(record)
+
+    def close(self):
+        for handler in self.files.values():
+            handler.close()
+        self.files.clear()
+        super().close()
+
+
+def start_listener(queue, level=logging.INFO):
+    """
+    Start writing the records put on queue to the box files' logs.
+    :return: the QueueListener, stop() it when done. Close and join any
+        Pool logging to queue first; a terminated worker can leave the
+        queue locked.
+    """
+    level_name = logging.getLevelName(parse_level(level)).lower()
+    listener = logging.handlers.QueueListener(queue, BoxLogRouter(level_name))
+    listener.start()
+    return listener
@@ -1,3 +1,4 @@
+import bisect
 import enum
 import logging
 import os
@@ -5,6 +6,7 @@ import numpy as np
 
 from banti.bantry import Space, Bantry
 from banti.linegraph import LineGraph
+from banti.post_process import DETACHED_AI, glyph_parts
 from TeluguDiacriticMap import Map
 from TeluguFontProperties import ABBR_DICT, PPU
 
@@ -45,30 +47,14 @@ class TaskAkshara():
 
 
 def get_parts(akshara):
-    # Class of tick plus underlying consonant + vowel
-    if '''ఘాఘుఘూఘౌపుపూఫుఫూషుషూసుసూహా
-    హుహూహొహోహౌ'''.find(akshara) >= 0:
-        return ['✓', akshara]
+    # Detached ai-karams, whose glyphs are not saved yet
+    if akshara in DETACHED_AI:
+        raise ValueError(akshara)
 
-    # Class of vowel-mark + underlying consonant base
-    if '''ఘిఘీఘెఘేపిపీపెపేఫిఫీఫెఫేషిషీషెషేసిసీసె
-    సేహిహీహెహేఘ్ప్ఫ్ష్స్హ్ '''.find(akshara) >= 0:
-        return [akshara[1], akshara[0]]
-
-    # Detached ai-karams
-    if 'ఘైపైఫైషైసైహై'.find(akshara) >= 0:
-        raise ValueError
-        # return ['ె' , akshara[0], 'ై']
-
-    # gho
-    if 'ఘొఘో'.find(akshara) >= 0:
-        if 'T' == 'T':  # Telugu gho_style style ఘొఘో
-            return ['✓', akshara]
-        else:  # Kannada style
-            return ['ె', 'ఘా' if akshara == 'ఘో' else 'ఘు']
-
-    # Combining marks like saa, pau etc.
-    return [akshara]
+    # ✓ plus underlying consonant + vowel, vowel-mark + underlying consonant
+    # base, or combining marks like saa, pau etc. ఘొ ఘో are in the Telugu
+    # style, ✓ + ఘొ, not the Kannada one, ె + ఘు.
+    return glyph_parts(akshara)
 
 
 def nature(akshara):
@@ -108,8 +94,8 @@ def nature(akshara):
     return ret
 
 
-def known(s):
-    if s in Bantry.classifier.unichars.labels:
+def known(s, classifier):
+    if s in classifier.unichars.labels:
         return True
     else:
         logd("{} is not found in labellings.lbl".format(s))
@@ -122,7 +108,12 @@ class Parser():
         self.txt_file, self.dir_prefix = txt_file, dir_prefix
         with open(txt_file, "r") as fp:
             lines = fp.read().splitlines()
-            self.text = [l for l in lines if l]
+        # Aksharas of each line, and where the line is in the text file
+        self.text, self.text_linenums = [], []
+        for linenum, line in enumerate(lines):
+            if line:
+                self.text.append(line.split())
+                self.text_linenums.append(linenum)
 
         self.existings_dirs = set()
         dir_prefix += "" if dir_prefix.endswith(".") else "."
@@ -130,6 +121,7 @@ class Parser():
 
         # Current File
         self.font, self.font_style, self.font_properties = "", "", []
+        self.first_line = 0  # Index in self.text of the file's first line
         # Current Line
         self.lbantries = []
         self.lgraph = LineGraph([Bantry()])
@@ -155,7 +147,8 @@ class Parser():
 
     def get_image_name(self, box):
         return '{}_{}_L{:02}W{:02}_{}_{}.tif'.format(
-            self.font, self.font_style, box.linenum, box.wordnum,
+            self.font, self.font_style, self.first_line + box.linenum,
+            box.wordnum,
             box.y - box.topline,
             box.y + box.ht - box.baseline)
 
@@ -169,20 +162,25 @@ class Parser():
         just_file_name = os.path.splitext(os.path.basename(box_file_name))[0]
         logi("Processing " + just_file_name)
 
-        self.font, self.font_style = just_file_name.split("_")
+        # Pages made by 2.text_to_images.py --lines are named
+        # <font>_<style>_L<number of their first line in the text file>
+        self.font, self.font_style, *page = just_file_name.split("_")
         self.font_properties = ABBR_DICT[self.font]
+        self.first_line = 0
+        if page:
+            self.first_line = bisect.bisect_left(self.text_linenums,
+                                                 int(page[0][1:]))
 
-        bantry_file, get_gramgraph = self.ocr.ocr_box_file(box_file_name)
+        lines = self.ocr.stream_box_file(box_file_name)
 
-        for iline in range(bantry_file.num_lines):
+        for iline, (lbantries, lgraph) in enumerate(lines, self.first_line):
             logi("Processing line number {}".format(iline))
             self.iline = iline
-            self.lbantries = bantry_file.get_line_bantires(iline)
-            self.lgraph = next(get_gramgraph)
+            self.lbantries, self.lgraph = lbantries, lgraph
             self.process_line()
 
     def process_line(self):
-        self.laksharas = self.text[self.iline].split()
+        self.laksharas = self.text[self.iline]
         start_indices = [i + 1 for (i, b) in enumerate(self.lbantries)
                          if b is Space]
         self.lindices = [0] + start_indices + [len(self.lbantries) + 1]
@@ -209,11 +207,13 @@ class Parser():
     def get_best_combo(self, start, end, first, second):
         wt = {False: .5, True: 1}
         max_strength, lb0, rb0 = 0, None, None
-        for lb, rb in self.get_all_combos(start, end):
+        combos = list(self.get_all_combos(start, end))
+        self.lgraph.evaluate_edges([b for combo in combos for b in combo])
+        for lb, rb in combos:
             strength = np.exp(lb.strength() + rb.strength())
-            if known(first):
+            if known(first, self.ocr.classifier):
                 strength *= wt[first == lb.best_char]
-            if known(second):
+            if known(second, self.ocr.classifier):
                 strength *= wt[second == rb.best_char]
 
             if strength > max_strength:
@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+
+from banti.benchmarks import synthetic_box_lines
+from banti.glyph import Glyph
+from banti.scaler import ScalerFactory
+
+SCALER = os.path.join(os.path.dirname(__file__), os.pardir,
+                      'banti', 'library', 'rel48.scl')
+
+
+def glyphs(n=20):
+    return [Glyph(line) for line in synthetic_box_lines(n)]
+
+
+def test_stays_packed():
+    glps = glyphs()
+    scaler = ScalerFactory(SCALER)
+    scaler.scale_batch(glps)
+    Glyph.union(glps[:3])
+    for g in glps:
+        g.img, g.sixpack
+    assert all(g._pix is None for g in glps)
+
+
+def test_pix_is_kept_until_dropped():
+    g = glyphs(1)[0]
+    assert g.pix is g.pix
+    assert not g.pix.flags.writeable
+    g.drop_pix()
+    assert g._pix is None
+
+
+def test_get_pixel():
+    g = glyphs(1)[0]
+    pix = g.unpack()
+    assert g._pix is None
+    for row in range(-g.ht, g.ht):
+        for col in range(-g.wd, g.wd):
+            assert g.get_pixel(row, col) == pix[row, col]
+    assert np.array_equal(g.unpack(), g.pix)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from banti.linegraph import LineGraph
+
+
+class Wt():
+    """Weight that merges with any neighbour, classified when evaluated."""
+    def __init__(self, text, classified=True):
+        self.text = text
+        self.classified = classified
+
+    def combine(self, other):
+        return True, Wt(self.text + other.text, classified=False)
+
+    @classmethod
+    def evaluate_many(cls, wts):
+        for wt in wts:
+            wt.classified = True
+
+    def strength(self):
+        return len(self.text)
+
+
+def only_pairs(wts):
+    allowed = np.zeros((len(wts) + 1, 3), dtype=bool)
+    allowed[:, 2] = True
+    return allowed
+
+
+def test_merge_stats():
+    graph = LineGraph([Wt(c) for c in 'abcd'])
+    graph.process_tree()
+    nfiltered, nmerged, nunevaluated = graph.merge_stats()
+    assert nfiltered == 0 and nmerged == nunevaluated > 0
+
+    graph.evaluate_edges()
+    assert graph.merge_stats() == (0, nmerged, 0)
+
+
+def test_merge_stats_filtered():
+    graph = LineGraph([Wt(c) for c in 'abcd'], merge_filter=only_pairs)
+    graph.process_tree()
+    nfiltered, nmerged, nunevaluated = graph.merge_stats()
+    assert nmerged == nunevaluated == 3
+    assert nfiltered > 0
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from banti.ngrambuild import GlyphSplitter
+
+LABELS = os.path.join(os.path.dirname(__file__), os.pardir,
+                      'banti', 'library', 'alphacodes.lbl')
+
+
+@pytest.fixture(scope='module')
+def splitter():
+    return GlyphSplitter(LABELS)
+
+
+@pytest.mark.parametrize('text, labels', [
+    ('పల్లవి', ['✓', 'ప', 'ల', '్ల', 'వి']),
+    ('కర్మ', ['క', 'ర', '్మ']),
+    ('అన్న', ['అ', 'న', '్న']),
+    ('క్షణం', ['క', '్ష', 'ణ', 'ం']),
+    ('అస్తు', ['అ', 'సు', '్త']),
+    ('ప్పు', ['ప', '్పు']),
+])
+def test_vattu_after_consonant(splitter, text, labels):
+    assert splitter(text) == labels
+
+
+def test_halant_of_split_akshara(splitter):
+    assert splitter('బస్') == ['బ', '్', 'స']
+
+
+def test_white_space(splitter):
+    assert splitter('  హా\n\tహో ') == ['✓', 'హా', ' ', '✓', 'హో']
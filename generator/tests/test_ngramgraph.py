@@ -0,0 +1,9 @@
+from banti.ngramgraph import PathNode
+
+
+def test_chars_in_order():
+    pn = PathNode(key=(' ',))
+    for seg in (('a',), ('b', 'c'), ('d',)):
+        pn = PathNode(pn.likli, pn.prior, seg, pn, (pn.key + seg)[-2:])
+    assert pn.chars == (' ', 'a', 'b', 'c', 'd')
+    assert pn.key == ('c', 'd')
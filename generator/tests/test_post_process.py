@@ -0,0 +1,42 @@
+import pytest
+
+import parser
+from banti.post_process import (DETACHED_AI, SIGN_FIRST, TICKED, glyph_parts,
+                                post_process, pre_process, pre_process_parts)
+
+SPLIT = TICKED + SIGN_FIRST + DETACHED_AI
+
+
+@pytest.mark.parametrize('akshara', SPLIT)
+def test_pre_process_splits_like_the_table(akshara):
+    assert pre_process_parts(akshara) == glyph_parts(akshara)
+    assert pre_process(' ' + akshara + ' ') == \
+        ' ' + ''.join(glyph_parts(akshara)) + ' '
+
+
+@pytest.mark.parametrize('akshara', TICKED + SIGN_FIRST)
+def test_parser_splits_like_the_table(akshara):
+    assert parser.get_parts(akshara) == glyph_parts(akshara)
+
+
+@pytest.mark.parametrize('akshara', DETACHED_AI)
+def test_parser_skips_detached_ai(akshara):
+    with pytest.raises(ValueError):
+        parser.get_parts(akshara)
+
+
+@pytest.mark.parametrize('akshara', SPLIT)
+def test_post_process_undoes_pre_process(akshara):
+    assert post_process(pre_process(akshara)) == akshara
+
+
+@pytest.mark.parametrize('akshara', ['పా', 'కి', 'పం', 'హుం', 'స్త', 'ప్పు',
+                                     'క్ష', 'కై'])
+def test_parser_and_pre_process_agree_elsewhere(akshara):
+    assert '✓' not in pre_process(akshara)
+    assert len(parser.get_parts(akshara)) == 1
+
+
+def test_vattu_is_not_split():
+    assert pre_process('అస్తు') == 'అసు్త'
+    assert pre_process_parts('బస్') == ['బ', '్', 'స']